@@ -1,15 +1,77 @@
-from fastapi import FastAPI, HTTPException
+import os
+import json
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 from typing import List, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from app.rag.retriever import retrieve
-from app.rag.generator import generate_answer, NO_ANSWER_MESSAGE
+from app.rag import clients
+from app.rag.embedding_cache import get_embedding_cache
+from app.rag.retriever import (
+    retrieve_async, embed_query_async, embed_queries_async, search_candidates_async, rerank_candidates_async,
+    adaptive_rerank_stats, RETRIEVER_BACKEND, LEXICAL_CANDIDATES, EMBEDDING_MODEL,
+)
+from app.rag.lexical import get_corpus_lexical_index, normalize_question
+from app.rag.local_index import get_local_index
+from app.rag.semantic_cache import get_semantic_cache
+from app.rag.rerank_cache import get_rerank_cache
+from app.rag.embed_batcher import get_embed_batcher
+from app.rag.singleflight import SingleFlight
+from app.rag.sessions import get_session_store, session_turn, SESSION_MAX_CANDIDATES
+from app.rag.resilience import CircuitOpen, upstream_unavailable, resilience_stats, FALLBACK_CACHE_THRESHOLD
+from app.rag.deadline import (
+    DeadlineExceeded, request_deadline, deadline_scope, current_deadline, with_deadline, budget_contexts,
+)
+from app.rag.metrics import request_trace, stage, annotate, render_metrics, INTENT_SHORT_CIRCUITS, EMPTY_CONTEXT_ANSWERS
+from app.rag.generator import generate_answer_async, stream_answer_async, NO_ANSWER_MESSAGE
+
+logger = logging.getLogger(__name__)
+
+# Collapse concurrent identical /chat questions into one pipeline run
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "1") == "1"
+chat_single_flight = SingleFlight()
+
+# /chat/batch: max questions per request, and how many rerank+generate runs go at once
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "500"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Own the process-wide clients for the lifetime of the app.
+    Connections are opened once at startup and reused by every request.
+    """
+    embedding_cache = get_embedding_cache()
+    if embedding_cache is not None:
+        warmed = await asyncio.to_thread(embedding_cache.warm)
+        logger.info(f"Embedding cache warmed with {warmed} vectors")
+    try:
+        clients.get_async_openai_client()
+        await clients.get_async_weaviate_client()
+    except Exception as e:
+        # Weaviate may come up after the API; the first request will reconnect.
+        logger.warning(f"Clients not available at startup: {e}")
+    if RETRIEVER_BACKEND == "local":
+        try:
+            await asyncio.to_thread(get_local_index)
+        except Exception as e:
+            logger.warning(f"Local index not loaded at startup: {e}")
+    elif LEXICAL_CANDIDATES > 0:
+        await asyncio.to_thread(get_corpus_lexical_index)
+    yield
+    await clients.aclose_clients()
+    if embedding_cache is not None:
+        embedding_cache.close()
 
-app = FastAPI(title="Saudipedia Chatbot API")
+app = FastAPI(title="Saudipedia Chatbot API", lifespan=lifespan)
 
 # CORS for frontend
 origins = [
@@ -28,6 +90,8 @@ app.add_middleware(
 # Request/Response Models
 class ChatRequest(BaseModel):
     message: str
+    session_id: Optional[str] = None
+    deadline_ms: Optional[int] = None  # defaults to REQUEST_DEADLINE_MS
 
 class SourceItem(BaseModel):
     section: str
@@ -39,11 +103,68 @@ class SourceItem(BaseModel):
 class ChatResponse(BaseModel):
     answer: str
     sources: List[SourceItem]
+    degradations: List[str] = []  # steps taken to meet the deadline (skip_rerank, fewer_contexts, short_answer)
+
+class BatchChatRequest(BaseModel):
+    messages: List[str]
+
+class BatchChatItem(BaseModel):
+    answer: Optional[str] = None
+    sources: List[SourceItem] = []
+    error: Optional[str] = None
+
+class BatchChatResponse(BaseModel):
+    results: List[BatchChatItem]
+
+# Client dependencies (shared, pooled, reconnect-on-failure).
+# If a client can't be created here, the RAG functions resolve it lazily,
+# so greetings still work while Weaviate/OpenAI are unavailable.
+def get_openai():
+    try:
+        return clients.get_async_openai_client()
+    except Exception as e:
+        logger.warning(f"OpenAI client unavailable: {e}")
+        return None
+
+async def get_weaviate():
+    if RETRIEVER_BACKEND == "local":
+        return None
+    try:
+        return await clients.get_async_weaviate_client()
+    except Exception as e:
+        logger.warning(f"Weaviate unavailable: {e}")
+        return None
 
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
 
+@app.get("/stats")
+def stats():
+    """
+    Cache hit/miss counters, adaptive rerank decisions, embedding batch sizes, single-flight
+    sharing, and per OpenAI endpoint the circuit breaker state, retries and hedge rate.
+    """
+    embedding_cache = get_embedding_cache()
+    semantic_cache = get_semantic_cache()
+    rerank_cache = get_rerank_cache()
+    embed_batcher = get_embed_batcher(EMBEDDING_MODEL)
+    return {
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "semantic_cache": semantic_cache.stats() if semantic_cache else None,
+        "rerank_cache": rerank_cache.stats() if rerank_cache else None,
+        "adaptive_rerank": adaptive_rerank_stats(),
+        "embed_batcher": embed_batcher.stats() if embed_batcher else None,
+        "single_flight": chat_single_flight.stats(),
+        "sessions": get_session_store().stats() if get_session_store() else None,
+        "resilience": resilience_stats(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus text format: stage/request latency histograms, pipeline counters and the /stats gauges."""
+    return PlainTextResponse(render_metrics(stats()), media_type="text/plain; version=0.0.4")
+
 def check_intent(message: str) -> Optional[str]:
     """
     Check if the message is a greeting or small talk.
@@ -70,36 +191,366 @@ def check_intent(message: str) -> Optional[str]:
         
     return None
 
+def build_sources(contexts: list) -> List[SourceItem]:
+    """Build the sources list with snippets from retrieved contexts."""
+    sources = []
+    for ctx in contexts:
+        sources.append(SourceItem(
+            section=ctx["section"],
+            question=ctx["question"],
+            source=ctx["source"],
+            score=ctx["score"],
+            snippet=ctx["text"][:200] + "..." if len(ctx["text"]) > 200 else ctx["text"]
+        ))
+    return sources
+
+def fallback_response(query_vector, e: Exception) -> ChatResponse:
+    """
+    Answer when generation is unavailable (open breaker, or transient errors past the
+    retries): the closest cached answer at FALLBACK_CACHE_THRESHOLD, else the no-answer message.
+    """
+    semantic_cache = get_semantic_cache()
+    cached = semantic_cache.get(query_vector, threshold=FALLBACK_CACHE_THRESHOLD) if semantic_cache is not None else None
+    logger.warning(f"Generation unavailable ({e}); answering from {'the semantic cache' if cached else 'the no-answer message'}.")
+    annotate(generation_fallback="cache" if cached else "no_answer")
+    return cached or ChatResponse(answer=NO_ANSWER_MESSAGE, sources=[])
+
+def applied_degradations() -> List[str]:
+    """Degradations applied so far to meet the current request's deadline."""
+    deadline = current_deadline()
+    return list(deadline.degradations) if deadline is not None else []
+
+async def embed_turn(message: str, session=None, openai_client=None):
+    """
+    (query, query_vector, message_vector) for a turn. A follow-up searches with the
+    previous question added (query), but its session's cached candidates came from that
+    previous question, so they are matched against the follow-up alone (message).
+    Both texts go out in one embeddings request.
+    """
+    query = session.retrieval_query(message) if session is not None else message
+    if query == message:
+        vector = await embed_query_async(message, client=openai_client)
+        return query, vector, vector
+    message_vector, query_vector = await embed_queries_async([message, query], client=openai_client)
+    return query, query_vector, message_vector
+
+async def session_contexts(message: str, message_vector, query: str, query_vector, session,
+                           openai_client=None, weaviate_client=None) -> list:
+    """
+    Contexts for a turn of a session: the candidates of the session's last retrieval
+    that are close enough to the question, reranked against it like fresh candidates;
+    else (or if none survives the rerank) a fresh hybrid search + rerank with the
+    combined query, whose candidates replace the session's.
+    """
+    session_store = get_session_store()
+    reused = session.match(session_store.pool, message_vector, top_k=SESSION_MAX_CANDIDATES)
+    if reused:
+        contexts = await rerank_candidates_async(message, reused, top_k=5, openai_client=openai_client)
+        if contexts:
+            session_store.reused += 1
+            annotate(session_reuse=True)
+            return contexts
+    session_store.retrieved += 1
+    candidates = await search_candidates_async(query, query_vector, weaviate_client, include_vector=True)
+    session.set_candidates(candidates, session_store.pool)
+    return await rerank_candidates_async(query, candidates, top_k=5, openai_client=openai_client)
+
+async def answer_question(message: str, openai_client=None, weaviate_client=None, session=None) -> ChatResponse:
+    """
+    Run the RAG pipeline for one question (semantic cache -> retrieve -> generate).
+    With a session, retrieval goes through its candidate cache (a fresh search adds
+    the previous question to the query), earlier turns are passed to the model, and the turn
+    is recorded. Follow-ups skip the semantic cache, since their answer depends on
+    the conversation.
+    """
+    # Embed once; serve paraphrases of earlier questions from the semantic cache
+    with stage("embed"):
+        query, query_vector, message_vector = await embed_turn(message, session, openai_client)
+    semantic_cache = get_semantic_cache() if session is None or not session.turns else None
+    if semantic_cache is not None:
+        cached = semantic_cache.get(query_vector)
+        if cached is not None:
+            annotate(cache_hit=True)
+            if session is not None:
+                session.add_turn(message, cached.answer)
+            return cached
+
+    # Retrieve relevant documents
+    if session is not None:
+        contexts = await session_contexts(message, message_vector, query, query_vector, session, openai_client, weaviate_client)
+    else:
+        contexts = await retrieve_async(message, top_k=5, weaviate_client=weaviate_client, openai_client=openai_client, query_vector=query_vector)
+    
+    # Generate answer (from fewer contexts when the deadline is close)
+    contexts = budget_contexts(contexts)
+    history = session.history() if session is not None else None
+    try:
+        answer = await generate_answer_async(message, contexts, client=openai_client, history=history)
+    except Exception as e:
+        if not upstream_unavailable(e):
+            raise
+        return fallback_response(query_vector, e)
+    
+    with stage("assemble"):
+        response = ChatResponse(answer=answer, sources=build_sources(contexts), degradations=applied_degradations())
+    # Degraded answers are not cached, so later requests get the full pipeline
+    if semantic_cache is not None and contexts and not response.degradations:
+        semantic_cache.set(query_vector, response)
+    if session is not None:
+        session.add_turn(message, answer)
+    return response
+
+async def answer_shared(message: str, openai_client=None, weaviate_client=None) -> ChatResponse:
+    """
+    answer_question for a single-flight run, under a fresh default deadline: the task
+    would otherwise inherit the first caller's deadline. Each waiter enforces its own.
+    """
+    with deadline_scope(request_deadline()):
+        return await answer_question(message, openai_client, weaviate_client)
+
 @app.post("/chat", response_model=ChatResponse)
-def chat(request: ChatRequest):
+async def chat(request: ChatRequest, openai_client=Depends(get_openai), weaviate_client=Depends(get_weaviate)):
     """
     RAG Chat endpoint.
     Retrieves relevant documents and generates an Arabic answer with citations.
+    Runs fully async so waiting on OpenAI/Weaviate doesn't hold a threadpool worker.
+    Concurrent identical questions (after normalization) share one pipeline run,
+    except within a session (session_id), whose answers depend on earlier turns,
+    and requests with their own deadline_ms.
+    The request has a deadline (deadline_ms); stages get the remaining budget and
+    degrade as it runs low, and a request that still runs out of time gets a 504.
     """
+    deadline = request_deadline(request.deadline_ms)
     try:
-        # 1. Check intent (Greetings/Small-talk)
-        intent_response = check_intent(request.message)
-        if intent_response:
-            return ChatResponse(answer=intent_response, sources=[])
+        with request_trace("chat"), deadline_scope(deadline):
+            # 1. Check intent (Greetings/Small-talk)
+            with stage("intent"):
+                intent_response = check_intent(request.message)
+            if intent_response:
+                INTENT_SHORT_CIRCUITS.inc()
+                annotate(intent=True)
+                return ChatResponse(answer=intent_response, sources=[])
 
-        # Retrieve relevant documents
-        contexts = retrieve(request.message, top_k=5)
-        
-        # Generate answer
-        answer = generate_answer(request.message, contexts)
-        
-        # Build sources list with snippets
-        sources = []
-        for ctx in contexts:
-            sources.append(SourceItem(
-                section=ctx["section"],
-                question=ctx["question"],
-                source=ctx["source"],
-                score=ctx["score"],
-                snippet=ctx["text"][:200] + "..." if len(ctx["text"]) > 200 else ctx["text"]
+            session_store = get_session_store() if request.session_id else None
+            if session_store is not None:
+                annotate(session=True)
+                session = session_store.get(request.session_id)
+                async with session_turn(session):
+                    response = await with_deadline(answer_question(request.message, openai_client, weaviate_client, session))
+                session_store.save(request.session_id, session)
+                return response
+
+            # A client-chosen deadline gets its own run, degraded to fit that budget
+            if not SINGLE_FLIGHT_ENABLED or request.deadline_ms is not None:
+                return await with_deadline(answer_question(request.message, openai_client, weaviate_client))
+            return await with_deadline(chat_single_flight.do(
+                normalize_question(request.message),
+                lambda: answer_shared(request.message, openai_client, weaviate_client),
             ))
         
-        return ChatResponse(answer=answer, sources=sources)
-        
     except Exception as e:
+        if isinstance(e, DeadlineExceeded) or deadline.expired():
+            logger.warning(f"Chat exceeded its {deadline.seconds:g}s deadline: {e}")
+            raise HTTPException(status_code=504, detail="Request deadline exceeded")
+        if isinstance(e, CircuitOpen):
+            logger.warning(f"Chat rejected: {e}")
+            raise HTTPException(status_code=503, detail=str(e))
+        logger.exception(f"Chat failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+async def answer_batch(messages: List[str], openai_client=None, weaviate_client=None,
+                       concurrency: int = BATCH_CONCURRENCY) -> List[BatchChatItem]:
+    """
+    Answer many questions with shared upstream calls.
+    Intents are answered without any upstream call; the remaining questions are
+    deduplicated, embedded in one batched request, searched concurrently and then
+    reranked/generated with at most `concurrency` in flight.
+    Results are in input order; a failure only affects its own item(s).
+    """
+    results: List[Optional[BatchChatItem]] = [None] * len(messages)
+    groups = {}  # normalized question -> input positions
+    with stage("intent"):
+        for i, message in enumerate(messages):
+            intent_response = check_intent(message)
+            if intent_response:
+                INTENT_SHORT_CIRCUITS.inc()
+                results[i] = BatchChatItem(answer=intent_response, sources=[])
+            else:
+                groups.setdefault(normalize_question(message), []).append(i)
+    annotate(batch_size=len(messages), unique_questions=len(groups))
+
+    if groups:
+        questions = [messages[positions[0]] for positions in groups.values()]
+        try:
+            with stage("embed"):
+                vectors = await embed_queries_async(questions, client=openai_client)
+        except Exception as e:
+            logger.error(f"Batch embedding failed for {len(questions)} questions: {e}")
+            vectors = [e] * len(questions)
+
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        semantic_cache = get_semantic_cache()
+
+        async def run_one(question: str, query_vector) -> BatchChatItem:
+            if isinstance(query_vector, Exception):
+                raise query_vector
+            if semantic_cache is not None:
+                cached = semantic_cache.get(query_vector)
+                if cached is not None:
+                    return BatchChatItem(answer=cached.answer, sources=cached.sources)
+            # Hybrid searches all run at once over the shared connection
+            candidates = await search_candidates_async(question, query_vector, weaviate_client)
+            async with semaphore:
+                contexts = await rerank_candidates_async(question, candidates, top_k=5, openai_client=openai_client)
+                answer = await generate_answer_async(question, contexts, client=openai_client)
+            with stage("assemble"):
+                response = ChatResponse(answer=answer, sources=build_sources(contexts))
+            if semantic_cache is not None and contexts:
+                semantic_cache.set(query_vector, response)
+            return BatchChatItem(answer=response.answer, sources=response.sources)
+
+        outcomes = await asyncio.gather(
+            *(run_one(q, v) for q, v in zip(questions, vectors)), return_exceptions=True
+        )
+        for positions, outcome in zip(groups.values(), outcomes):
+            if isinstance(outcome, Exception):
+                outcome = BatchChatItem(error=str(outcome) or type(outcome).__name__)
+            for i in positions:
+                results[i] = outcome
+    return results
+
+@app.post("/chat/batch", response_model=BatchChatResponse)
+async def chat_batch(request: BatchChatRequest, openai_client=Depends(get_openai), weaviate_client=Depends(get_weaviate)):
+    """
+    Batch RAG endpoint for offline jobs and integrations.
+    Returns one result per message, in input order, with per-item errors.
+    """
+    if len(request.messages) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_SIZE} messages per batch")
+    with request_trace("chat_batch"):
+        results = await answer_batch(request.messages, openai_client, weaviate_client)
+    return BatchChatResponse(results=results)
+
+def sse_event(event: str, data) -> str:
+    """Format one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, openai_client=Depends(get_openai), weaviate_client=Depends(get_weaviate)):
+    """
+    Streaming RAG Chat endpoint (Server-Sent Events).
+    Events:
+      sources: list of SourceItem, sent as soon as retrieval finishes
+      token:   {"text": ...} for each answer delta from the model
+      done:    {"answer": ..., "timings": {...}, "degradations": [...]} terminal event
+      error:   {"detail": ...} if the pipeline fails mid-stream
+    Intent short-circuits, semantic cache hits and empty-context answers are sent
+    as a single done event. The request deadline (deadline_ms) applies as for /chat.
+    """
+    deadline = request_deadline(request.deadline_ms)
+
+    async def events():
+        start = time.perf_counter()
+        timings = {}
+
+        def elapsed_ms():
+            return round((time.perf_counter() - start) * 1000, 1)
+
+        try:
+            with request_trace("chat_stream"), deadline_scope(deadline):
+                # 1. Check intent (Greetings/Small-talk)
+                with stage("intent"):
+                    intent_response = check_intent(request.message)
+                if intent_response:
+                    INTENT_SHORT_CIRCUITS.inc()
+                    annotate(intent=True)
+                    timings["total_ms"] = elapsed_ms()
+                    yield sse_event("done", {"answer": intent_response, "sources": [], "timings": timings})
+                    return
+
+                session_store = get_session_store() if request.session_id else None
+                session = session_store.get(request.session_id) if session_store is not None else None
+                if session is not None:
+                    annotate(session=True)
+
+                async with session_turn(session):
+                    # Semantic cache hit is sent as a single done event (not for session follow-ups)
+                    with stage("embed"):
+                        query, query_vector, message_vector = await embed_turn(request.message, session, openai_client)
+                    semantic_cache = get_semantic_cache() if session is None or not session.turns else None
+                    if semantic_cache is not None:
+                        cached = semantic_cache.get(query_vector)
+                        if cached is not None:
+                            annotate(cache_hit=True)
+                            if session is not None:
+                                session.add_turn(request.message, cached.answer)
+                                session_store.save(request.session_id, session)
+                            timings["total_ms"] = elapsed_ms()
+                            yield sse_event("done", {**cached.model_dump(), "timings": timings, "cached": True})
+                            return
+
+                    # Retrieve relevant documents
+                    if session is not None:
+                        contexts = await with_deadline(session_contexts(
+                            request.message, message_vector, query, query_vector, session, openai_client, weaviate_client
+                        ))
+                    else:
+                        contexts = await with_deadline(retrieve_async(request.message, top_k=5, weaviate_client=weaviate_client, openai_client=openai_client, query_vector=query_vector))
+                    timings["retrieval_ms"] = elapsed_ms()
+
+                    if not contexts:
+                        EMPTY_CONTEXT_ANSWERS.inc()
+                        timings["total_ms"] = elapsed_ms()
+                        yield sse_event("done", {"answer": NO_ANSWER_MESSAGE, "sources": [], "timings": timings,
+                                                 "degradations": applied_degradations()})
+                        return
+                    contexts = budget_contexts(contexts)
+
+                    with stage("assemble"):
+                        sources = build_sources(contexts)
+                    yield sse_event("sources", [s.model_dump() for s in sources])
+
+                    # Relay the answer token by token
+                    answer_parts = []
+                    try:
+                        with stage("generate"):
+                            history = session.history() if session is not None else None
+                            async for delta in stream_answer_async(request.message, contexts, client=openai_client, history=history):
+                                if not answer_parts:
+                                    timings["first_token_ms"] = elapsed_ms()
+                                answer_parts.append(delta)
+                                yield sse_event("token", {"text": delta})
+                    except Exception as e:
+                        if answer_parts or not upstream_unavailable(e):
+                            raise
+                        fallback = fallback_response(query_vector, e)
+                        timings["total_ms"] = elapsed_ms()
+                        yield sse_event("done", {**fallback.model_dump(), "timings": timings, "fallback": True})
+                        return
+
+                    answer = "".join(answer_parts)
+                    degradations = applied_degradations()
+                    if semantic_cache is not None and not degradations:
+                        semantic_cache.set(query_vector, ChatResponse(answer=answer, sources=sources))
+                    if session is not None:
+                        session.add_turn(request.message, answer)
+                        session_store.save(request.session_id, session)
+
+                    timings["total_ms"] = elapsed_ms()
+                    timings["generation_ms"] = round(timings["total_ms"] - timings["retrieval_ms"], 1)
+                    annotate(first_token_ms=timings.get("first_token_ms"))
+                    yield sse_event("done", {"answer": answer, "timings": timings, "degradations": degradations})
+
+        except Exception as e:
+            if isinstance(e, DeadlineExceeded) or deadline.expired():
+                logger.warning(f"Streaming chat exceeded its {deadline.seconds:g}s deadline: {e}")
+                yield sse_event("error", {"detail": "Request deadline exceeded"})
+                return
+            logger.exception(f"Streaming chat failed: {e}")
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,194 @@
+import os
+import asyncio
+import logging
+import threading
+from urllib.parse import urlparse
+
+import httpx
+import weaviate
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+from dotenv import load_dotenv
+
+from .resilience import RESILIENCE_ENABLED
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Weaviate connection (REST for schema/health, gRPC for queries)
+_weaviate_url = urlparse(os.getenv("WEAVIATE_URL", "http://localhost:8080"))
+WEAVIATE_HOST = _weaviate_url.hostname or "localhost"
+WEAVIATE_HTTP_PORT = _weaviate_url.port or 8080
+WEAVIATE_GRPC_PORT = int(os.getenv("WEAVIATE_GRPC_PORT", "50051"))
+
+# OpenAI HTTP connection pool
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+# SDK-level retries; off by default while the resilience layer retries (with jitter, per endpoint)
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "0" if RESILIENCE_ENABLED else "2"))
+
+_lock = threading.Lock()
+_openai_client = None
+_weaviate_client = None
+
+# Async counterparts, used by the API event loop
+_async_lock = None
+_async_openai_client = None
+_async_weaviate_client = None
+
+
+def _openai_api_key() -> str:
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY not set in environment")
+    return api_key
+
+
+def _openai_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_openai_client() -> OpenAI:
+    """
+    Return the process-wide OpenAI client.
+    The client keeps a pooled keep-alive HTTP connection set, so it must be shared
+    rather than rebuilt per call.
+    """
+    global _openai_client
+    if _openai_client is None:
+        with _lock:
+            if _openai_client is None:
+                _openai_client = OpenAI(
+                    api_key=_openai_api_key(),
+                    max_retries=OPENAI_MAX_RETRIES,
+                    http_client=DefaultHttpxClient(limits=_openai_limits()),
+                )
+    return _openai_client
+
+
+def get_weaviate_client() -> weaviate.WeaviateClient:
+    """
+    Return the process-wide Weaviate client, (re)connecting if needed.
+    Queries go over gRPC on WEAVIATE_GRPC_PORT.
+    """
+    global _weaviate_client
+    client = _weaviate_client
+    if client is not None and client.is_connected():
+        return client
+
+    with _lock:
+        if _weaviate_client is not None and _weaviate_client.is_connected():
+            return _weaviate_client
+        if _weaviate_client is not None:
+            logger.warning("Weaviate client disconnected. Reconnecting...")
+            _close_quietly(_weaviate_client)
+        _weaviate_client = weaviate.connect_to_local(
+            host=WEAVIATE_HOST,
+            port=WEAVIATE_HTTP_PORT,
+            grpc_port=WEAVIATE_GRPC_PORT,
+        )
+        return _weaviate_client
+
+
+def reset_weaviate_client():
+    """Drop the shared Weaviate client so the next call reconnects."""
+    global _weaviate_client
+    with _lock:
+        if _weaviate_client is not None:
+            _close_quietly(_weaviate_client)
+        _weaviate_client = None
+
+
+def close_clients():
+    """Close all shared clients. Called on application shutdown."""
+    global _openai_client, _weaviate_client
+    with _lock:
+        if _weaviate_client is not None:
+            _close_quietly(_weaviate_client)
+        if _openai_client is not None:
+            _close_quietly(_openai_client)
+        _weaviate_client = None
+        _openai_client = None
+
+
+def _get_async_lock() -> asyncio.Lock:
+    global _async_lock
+    if _async_lock is None:
+        _async_lock = asyncio.Lock()
+    return _async_lock
+
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """Return the process-wide AsyncOpenAI client (pooled, keep-alive)."""
+    global _async_openai_client
+    if _async_openai_client is None:
+        _async_openai_client = AsyncOpenAI(
+            api_key=_openai_api_key(),
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=DefaultAsyncHttpxClient(limits=_openai_limits()),
+        )
+    return _async_openai_client
+
+
+async def get_async_weaviate_client() -> weaviate.WeaviateAsyncClient:
+    """Return the process-wide async Weaviate client, (re)connecting if needed."""
+    global _async_weaviate_client
+    client = _async_weaviate_client
+    if client is not None and client.is_connected():
+        return client
+
+    async with _get_async_lock():
+        if _async_weaviate_client is not None and _async_weaviate_client.is_connected():
+            return _async_weaviate_client
+        if _async_weaviate_client is not None:
+            logger.warning("Async Weaviate client disconnected. Reconnecting...")
+            await _aclose_quietly(_async_weaviate_client)
+        client = weaviate.use_async_with_local(
+            host=WEAVIATE_HOST,
+            port=WEAVIATE_HTTP_PORT,
+            grpc_port=WEAVIATE_GRPC_PORT,
+        )
+        await client.connect()
+        _async_weaviate_client = client
+        return _async_weaviate_client
+
+
+async def reset_async_weaviate_client():
+    """Drop the shared async Weaviate client so the next call reconnects."""
+    global _async_weaviate_client
+    async with _get_async_lock():
+        if _async_weaviate_client is not None:
+            await _aclose_quietly(_async_weaviate_client)
+        _async_weaviate_client = None
+
+
+async def aclose_clients():
+    """Close all shared clients, sync and async. Called on application shutdown."""
+    global _async_lock, _async_openai_client, _async_weaviate_client
+    if _async_weaviate_client is not None:
+        await _aclose_quietly(_async_weaviate_client)
+    if _async_openai_client is not None:
+        await _aclose_quietly(_async_openai_client)
+    _async_weaviate_client = None
+    _async_openai_client = None
+    _async_lock = None
+    close_clients()
+
+
+async def _aclose_quietly(client):
+    try:
+        await client.close()
+    except Exception as e:
+        logger.warning(f"Error while closing client: {e}")
+
+
+def _close_quietly(client):
+    try:
+        client.close()
+    except Exception as e:
+        logger.warning(f"Error while closing client: {e}")
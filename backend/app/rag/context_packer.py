@@ -0,0 +1,105 @@
+import os
+import re
+import logging
+from typing import List, Dict, Any
+
+from dotenv import load_dotenv
+
+from .lexical import tokenize
+from .metrics import annotate
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Max prompt tokens spent on retrieved contexts (0 = no packing, full texts)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Token-set Jaccard similarity at which a sentence counts as a near-duplicate of one already kept
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+# Fallback estimate when tiktoken is not installed (Arabic averages ~3 characters per token)
+CHARS_PER_TOKEN = 3.0
+
+# Sentence ends: Latin/Arabic full stop, question mark, exclamation or Arabic semicolon
+# followed by whitespace, and line breaks. A stop inside a token ("1895.69", "3.5%",
+# URLs) is not a boundary.
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?؟؛])\s+|\s*\n\s*")
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return int(round(len(text) / CHARS_PER_TOKEN))
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENTENCE_END_RE.split(text) if s.strip()]
+
+
+def _jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def pack_contexts(question: str, contexts: List[Dict[str, Any]], budget: int = CONTEXT_TOKEN_BUDGET) -> List[str]:
+    """
+    Context texts trimmed to fit `budget` tokens, one per context in the same order
+    (an empty string means nothing of that context was kept), so [i] numbering stays
+    aligned with the sources built from `contexts`.
+    Near-duplicate sentences (across and within contexts) are dropped first. Every
+    context then gets its sentence with the highest overlap with the question, and
+    the remaining budget goes to sentences by overlap, then context rank, then
+    position. Kept sentences are emitted in their original order.
+    Texts are returned unchanged when everything fits, and so is any context whose
+    sentences were all kept.
+    """
+    if budget <= 0 or sum(count_tokens(ctx['text']) for ctx in contexts) <= budget:
+        return [ctx['text'] for ctx in contexts]
+
+    question_terms = set(tokenize(question))
+    sentences = []  # (context index, position, text, tokens, overlap)
+    kept_terms = []
+    for i, ctx in enumerate(contexts):
+        for pos, sentence in enumerate(split_sentences(ctx['text'])):
+            terms = set(tokenize(sentence))
+            if any(_jaccard(terms, other) >= CONTEXT_DEDUP_THRESHOLD for other in kept_terms):
+                continue
+            kept_terms.append(terms)
+            overlap = len(question_terms & terms) / len(question_terms) if question_terms else 0.0
+            sentences.append((i, pos, sentence, count_tokens(sentence), overlap))
+
+    best_per_context = {}
+    for s in sentences:
+        if s[0] not in best_per_context or s[4] > best_per_context[s[0]][4]:
+            best_per_context[s[0]] = s
+    rest = sorted((s for s in sentences if best_per_context[s[0]] is not s), key=lambda s: (-s[4], s[0], s[1]))
+
+    selected, used = [], 0
+    for s in list(best_per_context.values()) + rest:
+        if used + s[3] <= budget:
+            selected.append(s)
+            used += s[3]
+
+    packed = [[] for _ in contexts]
+    for i, _, sentence, _, _ in sorted(selected, key=lambda s: (s[0], s[1])):
+        packed[i].append(sentence)
+    return [
+        ctx['text'] if len(parts) == len(split_sentences(ctx['text'])) else " ".join(parts)
+        for ctx, parts in zip(contexts, packed)
+    ]
+
+
+def build_context_block(question: str, contexts: List[Dict[str, Any]]) -> str:
+    """Numbered context block for the generation prompt, packed to the token budget."""
+    texts = pack_contexts(question, contexts)
+    before = sum(count_tokens(ctx['text']) for ctx in contexts)
+    after = sum(count_tokens(text) for text in texts)
+    annotate(context_tokens_before=before, context_tokens_after=after)
+    logger.debug(f"Context packing: {before} -> {after} tokens ({len(contexts)} contexts)")
+    return "\n\n".join(f"[{i}] {text}" for i, text in enumerate(texts, 1) if text)
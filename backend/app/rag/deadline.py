@@ -0,0 +1,133 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+from .metrics import annotate
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Per-request deadline (clients may ask for less, up to REQUEST_DEADLINE_MAX_MS)
+REQUEST_DEADLINE_MS = int(os.getenv("REQUEST_DEADLINE_MS", "15000"))
+REQUEST_DEADLINE_MAX_MS = int(os.getenv("REQUEST_DEADLINE_MAX_MS", "60000"))
+
+# Degradation steps, by seconds left when the stage starts:
+# skip the reranker, then answer from fewer contexts, then cap the answer length
+DEGRADE_SKIP_RERANK_S = float(os.getenv("DEGRADE_SKIP_RERANK_S", "6"))
+DEGRADE_FEWER_CONTEXTS_S = float(os.getenv("DEGRADE_FEWER_CONTEXTS_S", "4"))
+DEGRADE_SHORT_ANSWER_S = float(os.getenv("DEGRADE_SHORT_ANSWER_S", "2.5"))
+DEGRADED_CONTEXTS = int(os.getenv("DEGRADED_CONTEXTS", "2"))
+DEGRADED_MAX_TOKENS = int(os.getenv("DEGRADED_MAX_TOKENS", "200"))
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline passed before a stage could run or finish."""
+
+
+class Deadline:
+    """Absolute deadline of one request, and the degradations applied to meet it."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.degradations: List[str] = []
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def timeout(self, cap: Optional[float] = None) -> float:
+        """Seconds a stage may take: what is left, at most `cap`. Raises DeadlineExceeded if none is left."""
+        remaining = self.remaining()
+        if remaining <= 0.0:
+            raise DeadlineExceeded(f"Request deadline of {self.seconds:g}s exceeded")
+        return remaining if cap is None else min(cap, remaining)
+
+    def degrade(self, step: str):
+        if step not in self.degradations:
+            self.degradations.append(step)
+            logger.info(f"Degrading request: {step} ({self.remaining():.2f}s left)")
+            annotate(degradations=list(self.degradations))
+
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar("request_deadline", default=None)
+
+
+def request_deadline(deadline_ms: Optional[int] = None) -> Deadline:
+    """Deadline for a request: the client's deadline_ms if given, capped at REQUEST_DEADLINE_MAX_MS."""
+    ms = REQUEST_DEADLINE_MS if deadline_ms is None else min(max(deadline_ms, 0), REQUEST_DEADLINE_MAX_MS)
+    return Deadline(ms / 1000.0)
+
+
+@contextmanager
+def deadline_scope(deadline: Deadline):
+    """Make `deadline` the current request's deadline for every stage run inside."""
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+def timeout_kwargs(cap: Optional[float] = None) -> dict:
+    """timeout= for an OpenAI call: the remaining budget (at most `cap`), or `cap` alone outside a request."""
+    deadline = current_deadline()
+    if deadline is not None:
+        return {"timeout": deadline.timeout(cap)}
+    return {} if cap is None else {"timeout": cap}
+
+
+async def with_deadline(awaitable):
+    """Await within the remaining budget (cancelling it when the budget runs out -> DeadlineExceeded)."""
+    deadline = current_deadline()
+    if deadline is None:
+        return await awaitable
+    try:
+        timeout = deadline.timeout()
+    except DeadlineExceeded:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"Request deadline of {deadline.seconds:g}s exceeded") from None
+
+
+def should_skip_rerank() -> bool:
+    deadline = current_deadline()
+    if deadline is not None and deadline.remaining() < DEGRADE_SKIP_RERANK_S:
+        deadline.degrade("skip_rerank")
+        return True
+    return False
+
+
+def budget_contexts(contexts: list) -> list:
+    """The contexts to generate from: the top DEGRADED_CONTEXTS when little time is left."""
+    deadline = current_deadline()
+    if deadline is not None and deadline.remaining() < DEGRADE_FEWER_CONTEXTS_S and len(contexts) > DEGRADED_CONTEXTS:
+        deadline.degrade("fewer_contexts")
+        return contexts[:DEGRADED_CONTEXTS]
+    return contexts
+
+
+def budget_max_tokens(max_tokens: int) -> int:
+    """Answer length cap: DEGRADED_MAX_TOKENS when little time is left."""
+    deadline = current_deadline()
+    if deadline is not None and deadline.remaining() < DEGRADE_SHORT_ANSWER_S and max_tokens > DEGRADED_MAX_TOKENS:
+        deadline.degrade("short_answer")
+        return DEGRADED_MAX_TOKENS
+    return max_tokens
@@ -0,0 +1,127 @@
+import os
+import asyncio
+import logging
+import contextvars
+from collections import Counter
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from .deadline import current_deadline, deadline_scope, timeout_kwargs
+from .resilience import call_openai
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+EMBED_BATCH_ENABLED = os.getenv("EMBED_BATCH_ENABLED", "0") == "1"
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "64"))
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent single-query embedding calls into one batched request.
+    The first call opens a window of `window_ms`; every call that arrives before it
+    closes (or until `max_batch` texts are queued) is sent in the same
+    embeddings.create(input=[...]) request, and each caller gets its own vector back.
+    The request runs outside every caller's context under the latest of their deadlines
+    (none if a caller has none); each caller enforces its own with with_deadline.
+    """
+
+    def __init__(self, model: str, window_ms: float = EMBED_BATCH_WINDOW_MS, max_batch: int = EMBED_BATCH_MAX):
+        self.model = model
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._pending = []  # (text, future, caller's deadline)
+        self._client = None
+        self._timer = None
+        self.batches = 0
+        self.items = 0
+        self.batch_sizes = Counter()
+        self.errors = 0
+
+    async def embed(self, text: str, client) -> list:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future, current_deadline()))
+        if self._client is None:
+            self._client = client
+
+        if len(self._pending) >= self.max_batch:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush_now)
+        return await future
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        client, self._client = self._client, None
+        if self._pending:
+            # Overflow beyond max_batch starts the next window
+            self._client = client
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush_now)
+        if batch:
+            # A fresh context: the timer callback runs in the first caller's, deadline included
+            contextvars.Context().run(asyncio.ensure_future, self._send(batch, client))
+
+    async def _send(self, batch: list, client):
+        deadlines = [deadline for _, _, deadline in batch]
+        if any(deadline is None for deadline in deadlines):
+            await self._request(batch, client)
+        else:
+            with deadline_scope(max(deadlines, key=lambda d: d.expires_at)):
+                await self._request(batch, client)
+
+    async def _request(self, batch: list, client):
+        # Identical texts in the same window are embedded once
+        unique_texts = list(dict.fromkeys(text for text, _, _ in batch))
+        self.batches += 1
+        self.items += len(batch)
+        self.batch_sizes[len(unique_texts)] += 1
+        try:
+            # Only single-text batches are hedged: their latency matches the single-query embed window
+            response = await call_openai(
+                "embed",
+                lambda: client.embeddings.create(input=unique_texts, model=self.model, **timeout_kwargs()),
+                hedge=len(unique_texts) == 1,
+            )
+            data = sorted(response.data, key=lambda d: d.index)
+            vectors = {text: item.embedding for text, item in zip(unique_texts, data)}
+            for text, future, _ in batch:
+                if not future.done():
+                    future.set_result(vectors[text])
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Batched embedding request failed ({len(unique_texts)} texts): {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "batches": self.batches,
+            "items": self.items,
+            "errors": self.errors,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+        }
+
+
+_embed_batcher = None
+
+
+def get_embed_batcher(model: str) -> Optional[EmbeddingBatcher]:
+    """Return the process-wide embedding batcher, or None if disabled."""
+    global _embed_batcher
+    if not EMBED_BATCH_ENABLED:
+        return None
+    if _embed_batcher is None:
+        _embed_batcher = EmbeddingBatcher(model)
+    return _embed_batcher
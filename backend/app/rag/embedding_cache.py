@@ -0,0 +1,217 @@
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from .cache import TTLCache
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Configuration
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "1") == "1"
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "2048"))
+EMBED_CACHE_TTL = float(os.getenv("EMBED_CACHE_TTL", "86400"))
+# Rows kept in the SQLite tier (~6 KB each); the oldest are pruned past this (0 = no cap)
+EMBED_CACHE_DISK_MAX = int(os.getenv("EMBED_CACHE_DISK_MAX", "50000"))
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", os.path.join(BASE_DIR, "storage", "embedding_cache.sqlite3"))
+
+# Keys per SELECT ... IN (...) (SQLite's default bound-parameter limit is 999)
+SQLITE_MAX_PARAMS = 500
+
+
+def normalize_query(text: str) -> str:
+    """Collapse whitespace/newlines; this is exactly the text sent to the embedding model."""
+    return " ".join(text.split())
+
+
+def cache_key(text: str, model: str) -> str:
+    return hashlib.sha1(f"{model}\x00{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier query embedding cache.
+    Tier 1: bounded in-process LRU with TTL.
+    Tier 2: SQLite file (float32 blobs) that survives restarts, capped at `disk_max`
+    rows: once 10% over, the oldest written rows are deleted in one go.
+    Keys are (model, normalized query text).
+    """
+
+    def __init__(self, path: str = EMBED_CACHE_PATH, maxsize: int = EMBED_CACHE_SIZE, ttl: float = EMBED_CACHE_TTL,
+                 disk_max: int = EMBED_CACHE_DISK_MAX):
+        self.path = path
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.disk_max = disk_max
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_pruned = 0
+        self._disk_rows = 0
+        self._lock = threading.Lock()
+        self._db = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_created_at ON embeddings (created_at)")
+            self._db.commit()
+            self._disk_rows = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        except sqlite3.Error as e:
+            # Persistent tier is best-effort; keep serving from memory
+            logger.warning(f"Embedding cache store unavailable at {path}: {e}")
+            self._db = None
+
+    def _from_memory(self, texts: list, model: str):
+        """Split texts into memory-tier hits ({text: vector}) and the rest ({key: text})."""
+        found, missing = {}, {}
+        for text in texts:
+            key = cache_key(text, model)
+            vector = self.memory.get(key)
+            if vector is not None:
+                found[text] = vector
+            else:
+                missing[key] = text
+        return found, missing
+
+    def _from_disk(self, missing: dict) -> dict:
+        """Look up {key: text} in the SQLite tier (blocking); hits are promoted to memory."""
+        found = {}
+        if self._db is not None and missing:
+            keys = list(missing)
+            with self._lock:
+                for start in range(0, len(keys), SQLITE_MAX_PARAMS):
+                    chunk = keys[start:start + SQLITE_MAX_PARAMS]
+                    rows = self._db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32).tolist()
+                        self.memory.set(key, vector)
+                        found[missing[key]] = vector
+                self.disk_hits += len(found)
+                self.misses += len(missing) - len(found)
+        else:
+            with self._lock:
+                self.misses += len(missing)
+        return found
+
+    def _to_disk(self, vectors: dict, model: str):
+        """Persist {text: vector} in one transaction (blocking)."""
+        if self._db is None or not vectors:
+            return
+        now = time.time()
+        rows = [
+            (cache_key(text, model), model, np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for text, vector in vectors.items()
+        ]
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, created_at) VALUES (?, ?, ?, ?)", rows
+            )
+            # Replaced keys are counted too, so the count may run ahead until the next prune
+            self._disk_rows += len(rows)
+            if self.disk_max and self._disk_rows > self.disk_max * 1.1:
+                self._prune_disk()
+            self._db.commit()
+
+    def _prune_disk(self):
+        """Delete the oldest rows down to disk_max (caller holds the lock)."""
+        self._disk_rows = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self._disk_rows - self.disk_max
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY created_at LIMIT ?)", (excess,)
+            )
+            self._disk_rows -= excess
+            self.disk_pruned += excess
+
+    def get_many(self, texts: list, model: str) -> dict:
+        """Cached vectors of the texts found in either tier, keyed by text."""
+        found, missing = self._from_memory(texts, model)
+        found.update(self._from_disk(missing))
+        return found
+
+    async def get_many_async(self, texts: list, model: str) -> dict:
+        """get_many for the event loop: memory hits stay on it, the SQLite lookup runs in a thread."""
+        found, missing = self._from_memory(texts, model)
+        if missing:
+            found.update(await asyncio.to_thread(self._from_disk, missing))
+        return found
+
+    def set_many(self, vectors: dict, model: str):
+        for text, vector in vectors.items():
+            self.memory.set(cache_key(text, model), vector)
+        self._to_disk(vectors, model)
+
+    async def set_many_async(self, vectors: dict, model: str):
+        """set_many for the event loop: the SQLite write and commit run in a thread."""
+        for text, vector in vectors.items():
+            self.memory.set(cache_key(text, model), vector)
+        await asyncio.to_thread(self._to_disk, vectors, model)
+
+    def get(self, text: str, model: str) -> Optional[list]:
+        return self.get_many([text], model).get(text)
+
+    def set(self, text: str, model: str, vector: list):
+        self.set_many({text: vector}, model)
+
+    def warm(self, limit: Optional[int] = None) -> int:
+        """Load the most recent persisted vectors into the memory tier (used at startup)."""
+        if self._db is None:
+            return 0
+        limit = limit or self.memory.maxsize
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, vector FROM embeddings ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        # Oldest first so the most recent end up as most-recently-used
+        for key, blob in reversed(rows):
+            self.memory.set(key, np.frombuffer(blob, dtype=np.float32).tolist())
+        return len(rows)
+
+    def close(self):
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+            self._db = None
+
+    def stats(self) -> dict:
+        return {
+            "memory_hits": self.memory.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "disk_rows": self._disk_rows,
+            "disk_pruned": self.disk_pruned,
+            "memory_size": len(self.memory),
+            "memory_evictions": self.memory.evictions,
+        }
+
+
+_embedding_cache = None
+_init_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Return the process-wide embedding cache, or None if disabled."""
+    global _embedding_cache
+    if not EMBED_CACHE_ENABLED:
+        return None
+    if _embedding_cache is None:
+        with _init_lock:
+            if _embedding_cache is None:
+                _embedding_cache = EmbeddingCache()
+    return _embedding_cache
@@ -0,0 +1,143 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+EMBEDDING_STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", os.path.join(BASE_DIR, "data", "processed", "embeddings"))
+
+
+def text_key(text: str) -> str:
+    """Hash identifying a text within one model's store."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Append-only on-disk store of document embeddings for one model, keyed by text hash.
+    Vectors live in one raw float32 file read through np.memmap (zero-copy); the
+    matching text hashes are kept one per line in a .keys file, in row order.
+    New vectors are appended in bulk: vectors first, then keys, each fsynced. Key lines
+    have a fixed length, so after a crash both files are cut back to the last complete
+    row before the next append.
+    """
+
+    def __init__(self, model: str, directory: str = EMBEDDING_STORE_DIR):
+        self.model = model
+        safe_name = re.sub(r"[^\w.-]", "_", model)
+        self.vectors_path = os.path.join(directory, f"{safe_name}.f32")
+        self.keys_path = os.path.join(directory, f"{safe_name}.keys")
+        self._lock = threading.Lock()
+        self._rows: Dict[str, int] = {}
+        self._matrix = None
+        self.dim = 0
+        self._load()
+
+    def _load(self):
+        keys = []
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, "r", encoding="ascii") as f:
+                # Only newline-terminated lines count; a torn last line is dropped
+                keys = [line.split("\t") for line in f.read().split("\n")[:-1]]
+        rows = 0
+        if keys:
+            self.dim = int(keys[0][1])
+            size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+            rows = min(len(keys), size // (4 * self.dim))
+        if rows:
+            # Swap the matrix before the row map so a concurrent get() never sees a row past it
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+            self._rows = {key: row for row, (key, _) in enumerate(keys[:rows])}
+        else:
+            self._rows = {}
+            self._matrix = None
+
+    def refresh(self):
+        """Re-read both files, e.g. after another process appended to the store."""
+        with self._lock:
+            self._load()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, text: str) -> bool:
+        return text_key(text) in self._rows
+
+    def row(self, text: str) -> Optional[int]:
+        """Row of a text's vector in matrix(), or None."""
+        return self._rows.get(text_key(text))
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """The stored vector for a text (a read-only view into the memmap), or None."""
+        row = self._rows.get(text_key(text))
+        return None if row is None else self._matrix[row]
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        return [self.get(text) for text in texts]
+
+    def missing(self, texts: List[str]) -> List[str]:
+        """Texts (deduplicated, in order) that have no stored vector."""
+        return [t for t in dict.fromkeys(texts) if text_key(t) not in self._rows]
+
+    def add_many(self, texts: List[str], vectors) -> int:
+        """Append vectors for texts not already stored. Returns the number added."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            new = {}
+            for text, vector in zip(texts, vectors):
+                key = text_key(text)
+                if key not in self._rows and key not in new:
+                    new[key] = vector
+            if not new:
+                return 0
+            block = np.stack(list(new.values()))
+            if self.dim and block.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {block.shape[1]} does not match store dimension {self.dim}")
+
+            dim = block.shape[1]
+            lines = [f"{key}\t{dim}\n" for key in new]
+            os.makedirs(os.path.dirname(self.vectors_path), exist_ok=True)
+            # Anything past the last complete row is left over from an interrupted append
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(len(self._rows) * 4 * dim)
+                f.write(block.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.keys_path, "a", encoding="ascii") as f:
+                f.truncate(len(self._rows) * len(lines[0]))
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            # Extend in memory instead of re-reading the keys file (_load is for startup/refresh).
+            # The memmap is grown (a new mapping, no read) before the new rows are published.
+            start = len(self._rows)
+            self.dim = dim
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(start + len(new), dim))
+            self._rows.update((key, start + i) for i, key in enumerate(new))
+            return len(new)
+
+    def matrix(self) -> Optional[np.ndarray]:
+        """All stored vectors as one (rows, dim) memmap."""
+        return self._matrix
+
+
+_stores: Dict[str, EmbeddingStore] = {}
+_init_lock = threading.Lock()
+
+
+def get_embedding_store(model: str) -> EmbeddingStore:
+    """Return the process-wide embedding store for a model, opening it on first use."""
+    if model not in _stores:
+        with _init_lock:
+            if model not in _stores:
+                _stores[model] = EmbeddingStore(model)
+    return _stores[model]
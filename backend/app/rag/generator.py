@@ -1,31 +1,24 @@
-import os
-from openai import OpenAI
 from dotenv import load_dotenv
+from .clients import get_openai_client, get_async_openai_client
+from .metrics import stage, EMPTY_CONTEXT_ANSWERS
+from .context_packer import build_context_block
+from .deadline import timeout_kwargs, budget_max_tokens
+from .resilience import call_openai, call_openai_sync
 
 load_dotenv()
 
 NO_ANSWER_MESSAGE = "عذرًا، لم أتمكن من العثور على هذه المعلومة في السياق المتاح."
 
-def get_openai_client():
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY not set in environment")
-    return OpenAI(api_key=api_key)
+GENERATION_MODEL = "gpt-4o-mini"
+MAX_TOKENS = 500
 
-def generate_answer(question: str, contexts: list) -> str:
+def _build_messages(question: str, contexts: list, history: list = None) -> list:
     """
-    Generate an Arabic answer using OpenAI based on retrieved contexts.
-    Returns the no-answer message if contexts are empty.
+    Build the chat messages for answer generation from numbered contexts.
+    history: earlier (question, answer) turns of the conversation, oldest first.
     """
-    if not contexts:
-        return NO_ANSWER_MESSAGE
-    
-    # Build context string with numbered references
-    context_parts = []
-    for i, ctx in enumerate(contexts, 1):
-        context_parts.append(f"[{i}] {ctx['text']}")
-    
-    context_str = "\n\n".join(context_parts)
+    # Numbered references, packed to CONTEXT_TOKEN_BUDGET ([i] matches the i-th source)
+    context_str = build_context_block(question, contexts)
     
     # Build the prompt
     system_prompt = """You are an Arabic knowledge assistant.
@@ -72,16 +65,80 @@ Return ONLY the final Arabic answer."""
 
 الإجابة:"""
 
-    client = get_openai_client()
+    messages = [{"role": "system", "content": system_prompt}]
+    for past_question, past_answer in history or []:
+        messages.append({"role": "user", "content": past_question})
+        messages.append({"role": "assistant", "content": past_answer})
+    messages.append({"role": "user", "content": user_prompt})
+    return messages
+
+def generate_answer(question: str, contexts: list, client=None, history: list = None) -> str:
+    """
+    Generate an Arabic answer using OpenAI based on retrieved contexts.
+    Uses the injected OpenAI client, or the shared process-wide client if omitted.
+    Returns the no-answer message if contexts are empty.
+    """
+    if not contexts:
+        EMPTY_CONTEXT_ANSWERS.inc()
+        return NO_ANSWER_MESSAGE
+
+    client = client or get_openai_client()
     
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-        temperature=0.3,
-        max_tokens=500
-    )
+    with stage("generate"):
+        response = call_openai_sync("generate", lambda: client.chat.completions.create(
+            model=GENERATION_MODEL,
+            messages=_build_messages(question, contexts, history),
+            temperature=0.3,
+            max_tokens=budget_max_tokens(MAX_TOKENS),
+            **timeout_kwargs()
+        ))
     
     return response.choices[0].message.content
+
+async def generate_answer_async(question: str, contexts: list, client=None, history: list = None) -> str:
+    """Async version of generate_answer, on the shared AsyncOpenAI client."""
+    if not contexts:
+        EMPTY_CONTEXT_ANSWERS.inc()
+        return NO_ANSWER_MESSAGE
+
+    client = client or get_async_openai_client()
+    
+    with stage("generate"):
+        response = await call_openai("generate", lambda: client.chat.completions.create(
+            model=GENERATION_MODEL,
+            messages=_build_messages(question, contexts, history),
+            temperature=0.3,
+            max_tokens=budget_max_tokens(MAX_TOKENS),
+            **timeout_kwargs()
+        ))
+    
+    return response.choices[0].message.content
+
+async def stream_answer_async(question: str, contexts: list, client=None, history: list = None):
+    """
+    Stream the answer as it is generated (stream=True).
+    Yields text deltas; yields the no-answer message once if contexts are empty.
+    """
+    if not contexts:
+        EMPTY_CONTEXT_ANSWERS.inc()
+        yield NO_ANSWER_MESSAGE
+        return
+
+    client = client or get_async_openai_client()
+
+    # Not hedged: a duplicate stream would hold a second connection open
+    stream = await call_openai("generate", lambda: client.chat.completions.create(
+        model=GENERATION_MODEL,
+        messages=_build_messages(question, contexts, history),
+        temperature=0.3,
+        max_tokens=budget_max_tokens(MAX_TOKENS),
+        stream=True,
+        **timeout_kwargs()
+    ), hedge=False)
+
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
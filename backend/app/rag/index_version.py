@@ -0,0 +1,50 @@
+import os
+import time
+import uuid
+import threading
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+INDEX_VERSION_PATH = os.getenv("INDEX_VERSION_PATH", os.path.join(BASE_DIR, "storage", "index_version"))
+INDEX_VERSION_POLL_SECONDS = float(os.getenv("INDEX_VERSION_POLL_SECONDS", "5"))
+
+_lock = threading.Lock()
+_cached_version = None
+_checked_at = 0.0
+
+
+def _read_version() -> str:
+    try:
+        with open(INDEX_VERSION_PATH, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
+
+
+def current_version() -> str:
+    """
+    Return the current KnowledgeDocument index version.
+    Caches keyed on indexed content compare against this to invalidate themselves
+    after a re-index. The marker file is re-read at most every INDEX_VERSION_POLL_SECONDS.
+    """
+    global _cached_version, _checked_at
+    now = time.monotonic()
+    if _cached_version is None or now - _checked_at >= INDEX_VERSION_POLL_SECONDS:
+        with _lock:
+            _cached_version = _read_version()
+            _checked_at = now
+    return _cached_version
+
+
+def bump_version() -> str:
+    """Write a new index version. Called by the indexing/reset scripts after they change the collection."""
+    global _cached_version, _checked_at
+    version = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    os.makedirs(os.path.dirname(INDEX_VERSION_PATH), exist_ok=True)
+    tmp_path = INDEX_VERSION_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, INDEX_VERSION_PATH)
+    with _lock:
+        _cached_version = version
+        _checked_at = time.monotonic()
+    return version
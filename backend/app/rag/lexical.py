@@ -0,0 +1,224 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import Counter, defaultdict
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PROCESSED_DATA_PATH = os.path.join(BASE_DIR, "data", "processed", "documents.jsonl")
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", os.path.join(BASE_DIR, "storage", "lexical_index.npz"))
+
+# BM25 parameters (same defaults as Weaviate)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Harakat (fathatan..sukun), superscript alef and tatweel
+_DIACRITICS_RE = re.compile("[\u064B-\u0652\u0670\u0640]")
+_CHAR_MAP = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ة": "ه",
+    "ى": "ي",
+})
+
+# Light prefix stripping: (prefix, minimum length left after stripping).
+# Longest first; single letters need a longer remainder so short words stay intact.
+_PREFIXES = (
+    ("وال", 2), ("بال", 2), ("ال", 2),
+    ("و", 3), ("ب", 3),
+)
+
+
+def normalize_arabic(text: str) -> str:
+    """Orthographic normalization: drop harakat/tatweel, unify alef forms, ة→ه, ى→ي."""
+    text = _DIACRITICS_RE.sub("", text.lower())
+    return text.translate(_CHAR_MAP)
+
+
+def normalize_question(text: str) -> str:
+    """Canonical form of a question for cache/dedup keys: normalized words, no punctuation."""
+    return " ".join(_TOKEN_RE.findall(normalize_arabic(text)))
+
+
+def light_stem(token: str) -> str:
+    for prefix, min_rest in _PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= min_rest:
+            return token[len(prefix):]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    return [light_stem(t) for t in _TOKEN_RE.findall(normalize_arabic(text))]
+
+
+class BM25Index:
+    """
+    Arabic-aware BM25 inverted index over a fixed list of documents.
+    Posting lists are stored compactly as three flat arrays (offsets, doc ids,
+    term frequencies), so scoring a query is a few vectorized scatter-adds into
+    one score array, and the whole index can be saved/loaded with np.savez.
+    """
+
+    def __init__(self, vocab: Dict[str, int], offsets: np.ndarray, doc_ids: np.ndarray,
+                 tfs: np.ndarray, doc_lengths: np.ndarray, k1: float = BM25_K1, b: float = BM25_B,
+                 fingerprint: str = ""):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.fingerprint = fingerprint
+        self.num_docs = len(doc_lengths)
+        self.avg_doc_length = float(doc_lengths.mean()) if self.num_docs else 0.0
+        self._norm = k1 * (1 - b + b * doc_lengths / max(self.avg_doc_length, 1e-9))
+
+    @classmethod
+    def build(cls, texts: List[str], fingerprint: str = "") -> "BM25Index":
+        postings = defaultdict(list)
+        doc_lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lengths[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                postings[term].append((doc_id, tf))
+
+        vocab = {}
+        offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        total = sum(len(p) for p in postings.values())
+        doc_ids = np.empty(total, dtype=np.int32)
+        tfs = np.empty(total, dtype=np.uint16)
+        pos = 0
+        for term_id, (term, plist) in enumerate(postings.items()):
+            vocab[term] = term_id
+            n = len(plist)
+            doc_ids[pos:pos + n] = [d for d, _ in plist]
+            tfs[pos:pos + n] = [min(tf, 65535) for _, tf in plist]
+            pos += n
+            offsets[term_id + 1] = pos
+        return cls(vocab, offsets, doc_ids, tfs, doc_lengths, fingerprint=fingerprint)
+
+    def scores(self, query: str) -> np.ndarray:
+        """Return the BM25 score of every document for the query (0 for no match)."""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        if not self.num_docs:
+            return scores
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            ids = self.doc_ids[start:end]
+            tfs = self.tfs[start:end].astype(np.float32)
+            df = end - start
+            idf = np.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+            scores[ids] += idf * tfs * (self.k1 + 1) / (tfs + self._norm[ids])
+        return scores
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k (doc index, score) pairs with a positive score, best first."""
+        scores = self.scores(query)
+        hits = np.flatnonzero(scores > 0)
+        if not hits.size:
+            return []
+        k = min(k, hits.size)
+        top = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        terms = np.array(sorted(self.vocab, key=self.vocab.get))
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            terms=terms, offsets=self.offsets, doc_ids=self.doc_ids, tfs=self.tfs,
+            doc_lengths=self.doc_lengths, params=np.array([self.k1, self.b]),
+            fingerprint=np.array(self.fingerprint),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(path, allow_pickle=False) as data:
+            vocab = {str(term): i for i, term in enumerate(data["terms"])}
+            k1, b = data["params"].tolist()
+            return cls(vocab, data["offsets"], data["doc_ids"], data["tfs"], data["doc_lengths"],
+                       k1=k1, b=b, fingerprint=str(data["fingerprint"]))
+
+
+def document_text(question: str, text: str) -> str:
+    """Text indexed for a document: the question and the answer text."""
+    return f"{question} {text}"
+
+
+class CorpusLexicalIndex:
+    """BM25 index over data/processed/documents.jsonl, with the documents it was built from."""
+
+    def __init__(self, index: BM25Index, documents: List[Dict[str, Any]]):
+        self.index = index
+        self.documents = documents
+
+    @staticmethod
+    def _fingerprint(path: str) -> str:
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    @classmethod
+    def load_or_build(cls, documents_path: str = PROCESSED_DATA_PATH,
+                      index_path: Optional[str] = LEXICAL_INDEX_PATH) -> "CorpusLexicalIndex":
+        """Load the serialized index if it matches the corpus, else build it (and save it)."""
+        with open(documents_path, "r", encoding="utf-8") as f:
+            documents = [json.loads(line) for line in f if line.strip()]
+        fingerprint = cls._fingerprint(documents_path)
+
+        if index_path and os.path.exists(index_path):
+            try:
+                index = BM25Index.load(index_path)
+                if index.fingerprint == fingerprint and index.num_docs == len(documents):
+                    return cls(index, documents)
+            except Exception as e:
+                logger.warning(f"Could not load lexical index from {index_path}: {e}")
+
+        start = time.perf_counter()
+        index = BM25Index.build(
+            [document_text(d["metadata"]["question"], d["text"]) for d in documents],
+            fingerprint=fingerprint,
+        )
+        logger.info(f"Lexical index built: {index.num_docs} documents, {len(index.vocab)} terms in {time.perf_counter() - start:.2f}s")
+        if index_path:
+            try:
+                index.save(index_path)
+            except OSError as e:
+                logger.warning(f"Could not save lexical index to {index_path}: {e}")
+        return cls(index, documents)
+
+    def search(self, query: str, k: int) -> List[Tuple[Dict[str, Any], float]]:
+        return [(self.documents[i], score) for i, score in self.index.search(query, k)]
+
+
+_corpus_index = None
+_init_lock = threading.Lock()
+
+
+def get_corpus_lexical_index() -> CorpusLexicalIndex:
+    """Return the process-wide lexical index over documents.jsonl, loading it on first use."""
+    global _corpus_index
+    if _corpus_index is None:
+        with _init_lock:
+            if _corpus_index is None:
+                _corpus_index = CorpusLexicalIndex.load_or_build()
+    return _corpus_index
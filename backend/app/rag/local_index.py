@@ -0,0 +1,291 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import tempfile
+import threading
+from typing import List, Dict, Any
+
+import numpy as np
+from dotenv import load_dotenv
+from weaviate.util import generate_uuid5
+
+from .clients import get_weaviate_client
+from .deadline import with_deadline
+from .embedding_store import get_embedding_store
+from .index_version import current_version
+from .lexical import BM25Index, document_text
+from .quantization import LOCAL_QUANTIZATION, QuantizedVectors
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PROCESSED_DATA_PATH = os.path.join(BASE_DIR, "data", "processed", "documents.jsonl")
+COLLECTION_NAME = "KnowledgeDocument"
+PROPERTY_NAMES = ["text", "question", "section", "source"]
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Where the local index gets its vectors: "weaviate" (iterate the collection) or
+# "store" (documents.jsonl + the on-disk embedding store, no Weaviate round trips)
+LOCAL_INDEX_SOURCE = os.getenv("LOCAL_INDEX_SOURCE", "weaviate")
+
+# Number of top hits taken from each half (vector / keyword) before fusion
+HYBRID_POOL_SIZE = int(os.getenv("LOCAL_HYBRID_POOL_SIZE", "100"))
+# Seconds before a failed reload is retried (the previous index is served meanwhile)
+LOCAL_INDEX_RETRY_S = float(os.getenv("LOCAL_INDEX_RETRY_S", "30"))
+
+
+def _top_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores, best first (argpartition + sort of k items)."""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+def _min_max(scores: np.ndarray) -> np.ndarray:
+    if scores.size == 0:
+        return scores
+    lo, hi = scores.min(), scores.max()
+    if hi - lo <= 1e-12:
+        return np.ones_like(scores)
+    return (scores - lo) / (hi - lo)
+
+
+class LocalHybridIndex:
+    """
+    In-process hybrid (vector + BM25) search over the whole KnowledgeDocument corpus.
+    All vectors live in one contiguous, L2-normalized float32 matrix, so vector scoring
+    is a single matrix-vector product. Scores are fused like Weaviate's relativeScoreFusion:
+    each half's top hits are min-max normalized and combined as
+    alpha * vector + (1 - alpha) * keyword.
+    With quantization ("int8" / "binary") only compressed codes are kept in memory:
+    the vector half is a quantized first pass whose shortlist is rescored against
+    `vectors` (e.g. the embedding store's memmap, rows selected by `rows`).
+    """
+
+    def __init__(self, vectors, properties: List[Dict[str, Any]], uuids: List[str], rows=None,
+                 quantization: str = LOCAL_QUANTIZATION):
+        if quantization != "none":
+            self.vectors = None
+            self.quantized = QuantizedVectors(vectors, quantization, rows=rows)
+        else:
+            vectors = np.ascontiguousarray(vectors if rows is None else vectors[rows], dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            self.vectors = vectors / norms
+            self.quantized = None
+        self.properties = properties
+        self.uuids = uuids
+        self.lexical = BM25Index.build([document_text(p.get("question", ""), p.get("text", "")) for p in properties])
+
+    def __len__(self):
+        return len(self.uuids)
+
+    @classmethod
+    def from_weaviate(cls, weaviate_client, quantization: str = LOCAL_QUANTIZATION) -> "LocalHybridIndex":
+        """
+        Load every object (properties + vector) from the KnowledgeDocument collection.
+        With quantization the float32 vectors are spilled to an (unlinked) temporary file
+        and rescored through np.memmap, so only the compressed codes stay in memory.
+        """
+        collection = weaviate_client.collections.get(COLLECTION_NAME)
+        spill = tempfile.TemporaryFile() if quantization != "none" else None
+        vectors, properties, uuids = [], [], []
+        dim = 0
+        for obj in collection.iterator(include_vector=True, return_properties=PROPERTY_NAMES):
+            vector = obj.vector.get("default") if isinstance(obj.vector, dict) else obj.vector
+            if vector is None:
+                continue
+            if spill is not None:
+                dim = len(vector)
+                spill.write(np.asarray(vector, dtype=np.float32).tobytes())
+            else:
+                vectors.append(vector)
+            properties.append({name: obj.properties.get(name, "") for name in PROPERTY_NAMES})
+            uuids.append(str(obj.uuid))
+        if spill is None:
+            return cls(np.asarray(vectors, dtype=np.float32), properties, uuids, quantization=quantization)
+        with spill:
+            spill.flush()
+            # The mapping keeps its own handle, so closing (and losing) the file is fine
+            matrix = (np.memmap(spill, dtype=np.float32, mode="r", shape=(len(uuids), dim)) if uuids
+                      else np.empty((0, 0), dtype=np.float32))
+        return cls(matrix, properties, uuids, quantization=quantization)
+
+    @classmethod
+    def from_store(cls, documents: List[Dict[str, Any]], store) -> "LocalHybridIndex":
+        """Build from processed documents and their vectors in the embedding store (docs without one are skipped)."""
+        rows, properties, uuids = [], [], []
+        for doc in documents:
+            row = store.row(doc["text"])
+            if row is None:
+                continue
+            rows.append(row)
+            properties.append({
+                "text": doc["text"],
+                "question": doc["metadata"]["question"],
+                "section": doc["metadata"]["section"],
+                "source": doc["metadata"]["source"],
+            })
+            uuids.append(str(generate_uuid5(doc["id"])))
+        missing = len(documents) - len(rows)
+        if missing:
+            logger.warning(f"{missing} documents have no stored embedding and are left out of the local index")
+        if not rows:
+            return cls(np.empty((0, store.dim), dtype=np.float32), properties, uuids)
+        return cls(store.matrix(), properties, uuids, rows=np.asarray(rows, dtype=np.int64))
+
+    def vector_scores(self, query_vector) -> np.ndarray:
+        q = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm > 0:
+            q = q / norm
+        return self.vectors @ q
+
+    def vector(self, i: int) -> np.ndarray:
+        """Full-precision vector of document i."""
+        if self.quantized is None:
+            return self.vectors[i]
+        return np.asarray(self.quantized.source[self.quantized.rows[i]], dtype=np.float32)
+
+    def search(self, query: str, query_vector, alpha: float, limit: int, include_vector: bool = False) -> List[Dict[str, Any]]:
+        """
+        Hybrid search. Returns candidate dicts in the same shape retrieve() builds
+        from Weaviate results (text, question, section, source, score, certainty, uuid,
+        plus the normalized vector_score/keyword_score halves, and vector if requested).
+        """
+        if not len(self):
+            return []
+
+        keyword_scores = self.lexical.scores(query)
+        if self.quantized is None:
+            vector_scores = self.vector_scores(query_vector)
+            vector_pool = _top_indices(vector_scores, HYBRID_POOL_SIZE)
+        else:
+            # Exact scores only for the rescored shortlist (the rest are filled in below if needed)
+            vector_scores = np.zeros(len(self), dtype=np.float32)
+            vector_pool, pool_scores = self.quantized.search(query_vector, HYBRID_POOL_SIZE)
+            vector_scores[vector_pool] = pool_scores
+
+        # Normalized score of each half (0 outside that half's top hits)
+        vector_norm = np.zeros(len(self), dtype=np.float32)
+        vector_norm[vector_pool] = _min_max(vector_scores[vector_pool])
+
+        keyword_norm = np.zeros(len(self), dtype=np.float32)
+        keyword_hits = np.flatnonzero(keyword_scores > 0)
+        keyword_pool = keyword_hits[_top_indices(keyword_scores[keyword_hits], HYBRID_POOL_SIZE)]
+        keyword_norm[keyword_pool] = _min_max(keyword_scores[keyword_pool])
+
+        fused = alpha * vector_norm + (1 - alpha) * keyword_norm
+        pool = np.union1d(vector_pool, keyword_pool)
+        top = pool[_top_indices(fused[pool], limit)]
+        if self.quantized is not None:
+            keyword_only = top[~np.isin(top, vector_pool)]
+            if keyword_only.size:
+                vector_scores[keyword_only] = self.quantized.exact_scores(query_vector, keyword_only)
+
+        candidates = []
+        for i in top:
+            props = self.properties[i]
+            candidates.append({
+                "text": props.get("text", ""),
+                "question": props.get("question", ""),
+                "section": props.get("section", ""),
+                "source": props.get("source", ""),
+                "score": float(fused[i]),
+                "certainty": float((1 + vector_scores[i]) / 2),
+                "vector_score": float(vector_norm[i]),
+                "keyword_score": float(keyword_norm[i]),
+                "uuid": self.uuids[i]
+            })
+            if include_vector:
+                candidates[-1]["vector"] = self.vector(i)
+        return candidates
+
+
+_local_index = None
+_local_index_version = None
+_init_lock = threading.Lock()
+_reload_task = None
+_reload_failed_at = None
+
+
+def _build_local_index(weaviate_client=None) -> LocalHybridIndex:
+    start = time.perf_counter()
+    if LOCAL_INDEX_SOURCE == "store":
+        with open(PROCESSED_DATA_PATH, "r", encoding="utf-8") as f:
+            documents = [json.loads(line) for line in f if line.strip()]
+        store = get_embedding_store(EMBEDDING_MODEL)
+        store.refresh()  # pick up vectors appended by scripts/index_weaviate.py
+        index = LocalHybridIndex.from_store(documents, store)
+    else:
+        index = LocalHybridIndex.from_weaviate(weaviate_client or get_weaviate_client())
+    logger.info(f"Local hybrid index loaded: {len(index)} documents in {time.perf_counter() - start:.2f}s"
+                + (f" ({index.quantized.mode}, {index.quantized.nbytes / 2**20:.1f} MiB)"
+                   if index.quantized is not None else ""))
+    return index
+
+
+def _reload(version: str, weaviate_client=None) -> LocalHybridIndex:
+    """Build the index for `version` and swap it in (blocking; one build at a time)."""
+    global _local_index, _local_index_version, _reload_failed_at
+    with _init_lock:
+        if _local_index is None or _local_index_version != version:
+            try:
+                index = _build_local_index(weaviate_client)
+            except Exception:
+                _reload_failed_at = time.monotonic()
+                raise
+            _local_index, _local_index_version = index, version
+            _reload_failed_at = None
+        return _local_index
+
+
+def _retry_due() -> bool:
+    return _reload_failed_at is None or time.monotonic() - _reload_failed_at >= LOCAL_INDEX_RETRY_S
+
+
+def get_local_index(weaviate_client=None) -> LocalHybridIndex:
+    """
+    Return the process-wide local index, loading it on first use and reloading it
+    when the index version changes (re-index). If a reload fails, the previous
+    index keeps being served and the reload is retried after LOCAL_INDEX_RETRY_S.
+    """
+    version = current_version()
+    if _local_index is not None and (_local_index_version == version or not _retry_due()):
+        return _local_index
+    try:
+        return _reload(version, weaviate_client)
+    except Exception as e:
+        if _local_index is None:
+            raise
+        logger.error(f"Local index reload failed, serving the previous one: {e}")
+        return _local_index
+
+
+def _reload_done(task: asyncio.Future):
+    if not task.cancelled() and task.exception() is not None and _local_index is not None:
+        logger.error(f"Local index reload failed, serving the previous one: {task.exception()}")
+
+
+async def get_local_index_async() -> LocalHybridIndex:
+    """
+    get_local_index for the event loop: the build runs in a worker thread. After a
+    re-index, requests keep searching the previous index until the new one is
+    swapped in; only a request arriving before the first load waits for it.
+    """
+    global _reload_task
+    version = current_version()
+    if _local_index is not None and (_local_index_version == version or not _retry_due()):
+        return _local_index
+    if _reload_task is None or _reload_task.done():
+        _reload_task = asyncio.ensure_future(asyncio.to_thread(_reload, version))
+        _reload_task.add_done_callback(_reload_done)
+    if _local_index is not None:
+        return _local_index
+    return await with_deadline(asyncio.shield(_reload_task))
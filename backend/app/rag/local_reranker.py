@@ -0,0 +1,142 @@
+import os
+import logging
+import threading
+from typing import List, Dict, Any
+
+import numpy as np
+from dotenv import load_dotenv
+
+from .lexical import tokenize, get_corpus_lexical_index
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+
+# Logistic calibration of the feature scorer. With these weights a candidate needs most
+# query terms in its question/text plus a decent vector match to clear 0.5, which is
+# what RERANK_THRESHOLD=0.5 means for the LLM reranker.
+FEATURE_BIAS = -4.0
+FEATURE_WEIGHTS = np.array([
+    3.0,  # idf-weighted coverage of query terms by the candidate's question
+    2.5,  # idf-weighted coverage of query terms by the candidate's text
+    1.5,  # Jaccard similarity between query and candidate question terms
+    1.0,  # hybrid score relative to the best candidate
+    2.0,  # vector cosine similarity (from certainty), clipped at 0
+], dtype=np.float32)
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+class FeatureReranker:
+    """
+    CPU reranker that scores all candidates in one vectorized pass over a few
+    features (term overlap with question/text, question similarity, hybrid score,
+    vector similarity) and maps them to a calibrated 0-1 score with a logistic.
+    """
+
+    name = "local"
+
+    def _idf(self, terms: List[str]) -> np.ndarray:
+        index = get_corpus_lexical_index().index
+        idf = np.empty(len(terms), dtype=np.float32)
+        for i, term in enumerate(terms):
+            term_id = index.vocab.get(term)
+            df = 0 if term_id is None else index.offsets[term_id + 1] - index.offsets[term_id]
+            idf[i] = np.log(1 + (index.num_docs - df + 0.5) / (df + 0.5))
+        return idf
+
+    def features(self, question: str, candidates: List[Dict[str, Any]]) -> np.ndarray:
+        query_terms = sorted(set(tokenize(question)))
+        n = len(candidates)
+        feats = np.zeros((n, len(FEATURE_WEIGHTS)), dtype=np.float32)
+        if not query_terms:
+            return feats
+
+        idf = self._idf(query_terms)
+        idf_total = float(idf.sum()) or 1.0
+        term_pos = {t: i for i, t in enumerate(query_terms)}
+        in_question = np.zeros((n, len(query_terms)), dtype=np.float32)
+        in_text = np.zeros((n, len(query_terms)), dtype=np.float32)
+        jaccard = np.zeros(n, dtype=np.float32)
+
+        for row, cand in enumerate(candidates):
+            question_terms = set(tokenize(cand.get("question", "")))
+            for term in question_terms & term_pos.keys():
+                in_question[row, term_pos[term]] = 1.0
+            for term in set(tokenize(cand.get("text", ""))) & term_pos.keys():
+                in_text[row, term_pos[term]] = 1.0
+            union = len(question_terms | term_pos.keys())
+            jaccard[row] = len(question_terms & term_pos.keys()) / union if union else 0.0
+
+        hybrid = np.array([c.get("score") or 0.0 for c in candidates], dtype=np.float32)
+        best = hybrid.max() if n else 0.0
+        certainty = np.array([c.get("certainty") or 0.5 for c in candidates], dtype=np.float32)
+
+        feats[:, 0] = in_question @ idf / idf_total
+        feats[:, 1] = in_text @ idf / idf_total
+        feats[:, 2] = jaccard
+        feats[:, 3] = hybrid / best if best > 0 else 0.0
+        feats[:, 4] = np.clip(2 * certainty - 1, 0.0, 1.0)
+        return feats
+
+    def score(self, question: str, candidates: List[Dict[str, Any]]) -> np.ndarray:
+        return _sigmoid(FEATURE_BIAS + self.features(question, candidates) @ FEATURE_WEIGHTS)
+
+
+class CrossEncoderReranker:
+    """
+    CPU cross-encoder reranker (sentence-transformers). Scores all (question, text)
+    pairs in one batched predict call. Whether predict returns logits (mapped to 0-1
+    with a sigmoid) or probabilities is decided once from the model's activation,
+    so every batch of a model is on the same scale.
+    """
+
+    name = "cross-encoder"
+
+    def __init__(self, model_name: str = CROSS_ENCODER_MODEL):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, device="cpu")
+        self.outputs_logits = _outputs_logits(self.model)
+        logger.info(f"Cross-encoder {model_name} outputs {'logits' if self.outputs_logits else 'probabilities'}")
+
+    def score(self, question: str, candidates: List[Dict[str, Any]]) -> np.ndarray:
+        pairs = [(question, c.get("text", "")[:600]) for c in candidates]
+        scores = np.asarray(self.model.predict(pairs, batch_size=len(pairs)), dtype=np.float32)
+        return _sigmoid(scores) if self.outputs_logits else scores
+
+
+def _outputs_logits(model) -> bool:
+    """True unless the CrossEncoder's predict already applies a sigmoid (attribute name differs across versions)."""
+    activation = getattr(model, "activation_fn", None) or getattr(model, "default_activation_function", None)
+    return activation is None or type(activation).__name__ != "Sigmoid"
+
+
+_rerankers = {}
+_init_lock = threading.Lock()
+
+
+def get_local_reranker(backend: str):
+    """Return the process-wide local reranker for a backend name ("local" or "cross-encoder")."""
+    if backend not in _rerankers:
+        with _init_lock:
+            if backend not in _rerankers:
+                if backend == "local":
+                    _rerankers[backend] = FeatureReranker()
+                elif backend == "cross-encoder":
+                    _rerankers[backend] = CrossEncoderReranker()
+                else:
+                    raise ValueError(f"Unknown reranker backend: {backend}")
+    return _rerankers[backend]
+
+
+def local_rerank(question: str, candidates: List[Dict[str, Any]], backend: str = "local") -> List[Dict[str, Any]]:
+    """Score candidates with a local reranker, set 'rerank_score' (0-1) and sort."""
+    scores = get_local_reranker(backend).score(question, candidates)
+    for cand, score in zip(candidates, scores):
+        cand["rerank_score"] = round(float(score), 4)
+    candidates.sort(key=lambda x: x["rerank_score"], reverse=True)
+    return candidates
@@ -0,0 +1,224 @@
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds (upper bounds; +Inf is implicit)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """Monotonic counter with optional labels, rendered in Prometheus text format."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        return self._values.get(key, 0.0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        values = self._values or ({} if self.labelnames else {(): 0.0})
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Gauge:
+    """Current value with optional labels, rendered in Prometheus text format."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        REGISTRY.append(self)
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        self._values[key] = value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels, rendered in Prometheus text format."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], list] = {}  # key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+            counts = series[:len(self.buckets)] + [series[-1]]
+            for bound, count in zip(bounds, counts):
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+REGISTRY: list = []
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds", "Time spent in each pipeline stage.", ("stage",))
+REQUEST_SECONDS = Histogram(
+    "rag_request_duration_seconds", "End-to-end request latency.", ("endpoint",))
+REQUESTS = Counter(
+    "rag_requests_total", "Requests by endpoint and outcome.", ("endpoint", "status"))
+RERANK_FALLBACKS = Counter(
+    "rag_rerank_fallback_total", "Rerank calls that fell back to the hybrid (or local) order.")
+INTENT_SHORT_CIRCUITS = Counter(
+    "rag_intent_short_circuit_total", "Messages answered by check_intent without the RAG pipeline.")
+EMPTY_CONTEXT_ANSWERS = Counter(
+    "rag_empty_context_total", "Questions answered with the no-answer message because no context survived retrieval.")
+THRESHOLD_DROPS = Counter(
+    "rag_threshold_drops_total", "Candidates dropped by the rerank threshold.")
+UPSTREAM_CALLS = Counter(
+    "rag_upstream_calls_total", "OpenAI calls made through the resilience layer, by endpoint.", ("endpoint",))
+UPSTREAM_RETRIES = Counter(
+    "rag_upstream_retries_total", "OpenAI call retries after a transient error, by endpoint.", ("endpoint",))
+UPSTREAM_HEDGES = Counter(
+    "rag_upstream_hedges_total", "Duplicate (hedged) OpenAI requests sent, by endpoint.", ("endpoint",))
+UPSTREAM_HEDGE_WINS = Counter(
+    "rag_upstream_hedge_wins_total", "Hedged requests that answered before the original, by endpoint.", ("endpoint",))
+BREAKER_REJECTIONS = Counter(
+    "rag_breaker_rejections_total", "OpenAI calls rejected by an open circuit breaker, by endpoint.", ("endpoint",))
+BREAKER_STATE = Gauge(
+    "rag_breaker_state", "Circuit breaker state by endpoint (0 closed, 1 half-open, 2 open).", ("endpoint",))
+
+_current_trace: ContextVar[Optional["RequestTrace"]] = ContextVar("rag_request_trace", default=None)
+
+
+class RequestTrace:
+    """Per-request stage breakdown, logged as one structured line when the request ends."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.fields: Dict[str, object] = {}
+
+    def add(self, stage_name: str, seconds: float):
+        self.stages[stage_name] = self.stages.get(stage_name, 0.0) + seconds
+
+    def finish(self, status: str):
+        total = time.perf_counter() - self.start
+        REQUEST_SECONDS.observe(total, endpoint=self.endpoint)
+        REQUESTS.inc(endpoint=self.endpoint, status=status)
+        record = {
+            "endpoint": self.endpoint,
+            "status": status,
+            "total_ms": round(total * 1000, 1),
+            "stages_ms": {name: round(s * 1000, 1) for name, s in self.stages.items()},
+            **self.fields,
+        }
+        logger.info(f"request {json.dumps(record, ensure_ascii=False)}")
+
+
+@contextmanager
+def request_trace(endpoint: str):
+    """Trace one request: stages timed inside it are added to its log line."""
+    trace = RequestTrace(endpoint)
+    token = _current_trace.set(trace)
+    status = "ok"
+    try:
+        yield trace
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        _current_trace.reset(token)
+        trace.finish(status)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a pipeline stage into the stage histogram and the current request trace."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage=name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, seconds)
+
+
+def annotate(**fields):
+    """Attach fields (e.g. contexts=3, cache_hit=True) to the current request's log line."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.fields.update(fields)
+
+
+def _stats_gauges(prefix: str, stats: dict) -> list:
+    lines = []
+    for key, value in stats.items():
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float)):
+            name = f"rag_{prefix}_{key}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value:g}")
+    return lines
+
+
+def render_metrics(component_stats: Optional[Dict[str, Optional[dict]]] = None) -> str:
+    """Prometheus text exposition of all metrics, plus numeric fields of component stats as gauges."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for prefix, stats in (component_stats or {}).items():
+        if stats:
+            lines.extend(_stats_gauges(prefix, stats))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,119 @@
+import os
+import logging
+from typing import Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# In-process vector quantization for the local backend: "none", "int8" or "binary"
+LOCAL_QUANTIZATION = os.getenv("LOCAL_QUANTIZATION", "none")
+# Shortlist size for full-precision rescoring, as a multiple of the requested hits
+QUANTIZATION_RESCORE = int(os.getenv("QUANTIZATION_RESCORE", "4"))
+
+# Rows converted per block (bounds the float32 temporaries of a scan)
+BLOCK_ROWS = 65536
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def l2_normalize(block: np.ndarray) -> np.ndarray:
+    block = np.asarray(block, dtype=np.float32)
+    norms = np.linalg.norm(block, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return block / norms
+
+
+def _popcount(x: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x)
+    return _POPCOUNT[x]
+
+
+class QuantizedVectors:
+    """
+    Compressed copy of a vector matrix for a fast first pass, plus full-precision rescoring.
+    int8 keeps each L2-normalized vector as int8 codes with a per-vector scale (4x smaller);
+    binary keeps only the sign bits around the corpus mean (32x smaller) and ranks by
+    Hamming distance; centering first keeps the bits informative when embeddings share
+    a common offset (as OpenAI embeddings do).
+    The float32 source (typically the embedding store's np.memmap) is only read for
+    the shortlisted rows, so it can stay on disk. `rows` maps index positions to source rows.
+    """
+
+    def __init__(self, source, mode: str = "int8", rows: Optional[np.ndarray] = None, rescore: int = QUANTIZATION_RESCORE):
+        if mode not in ("int8", "binary"):
+            raise ValueError(f"Unknown quantization mode: {mode}")
+        self.source = source
+        self.rows = np.arange(source.shape[0]) if rows is None else np.asarray(rows, dtype=np.int64)
+        self.mode = mode
+        self.rescore = max(1, rescore)
+        self.dim = source.shape[1]
+
+        n = len(self.rows)
+        if mode == "int8":
+            self.codes = np.empty((n, self.dim), dtype=np.int8)
+            self.scales = np.empty(n, dtype=np.float32)
+        else:
+            self.codes = np.empty((n, (self.dim + 7) // 8), dtype=np.uint8)
+            self.scales = None
+            self.center = np.zeros(self.dim, dtype=np.float32)
+            for start in range(0, n, BLOCK_ROWS):
+                self.center += l2_normalize(source[self.rows[start:start + BLOCK_ROWS]]).sum(axis=0)
+            self.center /= max(n, 1)
+        for start in range(0, n, BLOCK_ROWS):
+            block = l2_normalize(source[self.rows[start:start + BLOCK_ROWS]])
+            if mode == "int8":
+                peak = np.abs(block).max(axis=1)
+                peak[peak == 0] = 1.0
+                self.codes[start:start + len(block)] = np.round(block * (127.0 / peak[:, None]))
+                self.scales[start:start + len(block)] = peak / 127.0
+            else:
+                self.codes[start:start + len(block)] = np.packbits(block > self.center, axis=1)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def nbytes(self) -> int:
+        """Resident size of the compressed index."""
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def approximate_scores(self, query_vector) -> np.ndarray:
+        """First-pass similarity of the query to every vector (higher is better)."""
+        q = l2_normalize(query_vector)
+        scores = np.empty(len(self), dtype=np.float32)
+        if self.mode == "int8":
+            for start in range(0, len(self), BLOCK_ROWS):
+                block = self.codes[start:start + BLOCK_ROWS]
+                scores[start:start + len(block)] = (block.astype(np.float32) @ q) * self.scales[start:start + len(block)]
+        else:
+            q_bits = np.packbits(q > self.center)
+            for start in range(0, len(self), BLOCK_ROWS):
+                block = self.codes[start:start + BLOCK_ROWS]
+                hamming = _popcount(block ^ q_bits).sum(axis=1, dtype=np.int32)
+                # Hamming distance mapped onto a cosine-like scale
+                scores[start:start + len(block)] = 1.0 - 2.0 * hamming / self.dim
+        return scores
+
+    def exact_scores(self, query_vector, indices: np.ndarray) -> np.ndarray:
+        """Cosine similarity against the float32 source, for the given index positions only."""
+        q = l2_normalize(query_vector)
+        rows = self.rows[indices]
+        order = np.argsort(rows)  # ascending rows keep memmap reads sequential
+        scores = np.empty(len(rows), dtype=np.float32)
+        scores[order] = l2_normalize(self.source[rows[order]]) @ q
+        return scores
+
+    def search(self, query_vector, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k index positions (best first) and their exact cosine scores."""
+        approx = self.approximate_scores(query_vector)
+        shortlist_size = min(len(self), k * self.rescore)
+        if shortlist_size <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        shortlist = np.argpartition(-approx, shortlist_size - 1)[:shortlist_size]
+        exact = self.exact_scores(query_vector, shortlist)
+        best = np.argsort(-exact, kind="stable")[:k]
+        return shortlist[best], exact[best]
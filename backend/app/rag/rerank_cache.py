@@ -0,0 +1,69 @@
+import os
+import logging
+import threading
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from .cache import TTLCache
+from .index_version import current_version
+from .lexical import normalize_question
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+RERANK_CACHE_ENABLED = os.getenv("RERANK_CACHE_ENABLED", "1") == "1"
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+RERANK_CACHE_TTL = float(os.getenv("RERANK_CACHE_TTL", "3600"))
+
+
+class RerankCache:
+    """
+    Per-(normalized question, document uuid) relevance scores from the reranker.
+    Bounded LRU with TTL; cleared when the index version changes (re-index).
+    """
+
+    def __init__(self, maxsize: int = RERANK_CACHE_SIZE, ttl: float = RERANK_CACHE_TTL):
+        self.scores = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.invalidations = 0
+        self._version = current_version()
+        self._lock = threading.Lock()
+
+    def _check_version(self):
+        version = current_version()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    logger.info("Index version changed; clearing rerank cache.")
+                    self.scores.clear()
+                    self._version = version
+                    self.invalidations += 1
+
+    def get(self, question: str, uuid: str) -> Optional[float]:
+        self._check_version()
+        return self.scores.get((normalize_question(question), uuid))
+
+    def set(self, question: str, uuid: str, score: float):
+        self._check_version()
+        self.scores.set((normalize_question(question), uuid), score)
+
+    def stats(self) -> dict:
+        return {**self.scores.stats(), "invalidations": self.invalidations}
+
+
+_rerank_cache = None
+_init_lock = threading.Lock()
+
+
+def get_rerank_cache() -> Optional[RerankCache]:
+    """Return the process-wide rerank score cache, or None if disabled."""
+    global _rerank_cache
+    if not RERANK_CACHE_ENABLED:
+        return None
+    if _rerank_cache is None:
+        with _init_lock:
+            if _rerank_cache is None:
+                _rerank_cache = RerankCache()
+    return _rerank_cache
@@ -1,9 +1,15 @@
 import os
 import json
+import asyncio
 import logging
 from typing import List, Dict, Any
-from openai import OpenAI
 from dotenv import load_dotenv
+from .clients import get_openai_client, get_async_openai_client
+from .rerank_cache import get_rerank_cache
+from .local_reranker import local_rerank
+from .metrics import RERANK_FALLBACKS
+from .deadline import timeout_kwargs
+from .resilience import call_openai, call_openai_sync
 
 load_dotenv()
 
@@ -11,28 +17,17 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_openai_client() -> OpenAI:
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY not set in environment")
-    return OpenAI(api_key=api_key)
+RERANK_MODEL = "gpt-4o-mini"
+RERANK_TIMEOUT = 10 # Fail-safe timeout (seconds), shortened to the request's remaining budget
 
-def rerank(question: str, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """
-    Reranks a list of candidate documents based on their relevance to the question
-    using gpt-4o-mini.
-    
-    Args:
-        question: The user's question.
-        candidates: List of dictionaries, each containing at least 'text'.
-        
-    Returns:
-        List[Dict]: The candidates list with updated scores and sorted by relevance.
-                    Adds 'rerank_score' to each candidate.
-    """
-    if not candidates:
-        return []
+# Reranker backend: "llm" (gpt-4o-mini), "local" (CPU feature scorer) or "cross-encoder"
+RERANKER_BACKEND = os.getenv("RERANKER_BACKEND", "llm")
+# When the LLM reranker fails: "hybrid" keeps the hybrid order (no threshold filtering),
+# "local" scores with the CPU feature scorer so the threshold still applies
+RERANKER_FALLBACK = os.getenv("RERANKER_FALLBACK", "hybrid")
 
+def _build_messages(question: str, candidates: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """Build the chat messages asking the LLM to score each candidate."""
     # Prepare candidates for the prompt (trim to max 600 chars)
     prompt_candidates = []
     for idx, cand in enumerate(candidates, 1):
@@ -69,59 +64,168 @@ def rerank(question: str, candidates: List[Dict[str, Any]]) -> List[Dict[str, An
 المطلوب:
 قم بترتيب النصوص حسب الصلة وأعطني JSON فقط."""
 
-    client = get_openai_client()
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def _apply_ranking(content: str, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Parse the reranker JSON output and assign/sort by 'rerank_score'."""
+    if not content:
+        logger.warning("Reranker returned empty content.")
+        return candidates
+
+    data = json.loads(content)
+    ranking = data.get("ranking", [])
+
+    # Create score map: index (int) -> score (float)
+    score_map = {}
+    for item in ranking:
+        try:
+            idx = int(item.get("i"))
+            score = float(item.get("score"))
+            score_map[idx] = score
+        except (ValueError, TypeError):
+            continue
+
+    # Assign scores to candidates
+    # Note: prompt used 1-based index, cand list is 0-based
+    for i, cand in enumerate(candidates):
+        # Default to 0.0 if not found in LLM output, or keep original weak score behavior?
+        # We'll default to 0.0 effectively dropping it if strictly filtering.
+        # But let's check if we want fallback for items missed?
+        # Usually LLM should return all, but if it skips, it's likely irrelevant.
+        cand["rerank_score"] = score_map.get(i + 1, 0.0)
+
+    # Sort by rerank_score descending
+    candidates.sort(key=lambda x: x["rerank_score"], reverse=True)
+    
+    return candidates
 
+def _apply_cached_scores(question: str, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Assign cached scores; return the candidates that still need the LLM."""
+    cache = get_rerank_cache()
+    if cache is None:
+        return candidates
+
+    pending = []
+    for cand in candidates:
+        score = cache.get(question, cand["uuid"]) if cand.get("uuid") else None
+        if score is None:
+            pending.append(cand)
+        else:
+            cand["rerank_score"] = score
+            cand["rerank_cached"] = True
+    return pending
+
+def _store_scores(question: str, scored: List[Dict[str, Any]]):
+    cache = get_rerank_cache()
+    if cache is None:
+        return
+    for cand in scored:
+        if "rerank_score" in cand and cand.get("uuid"):
+            cache.set(question, cand["uuid"], cand["rerank_score"])
+
+def _sort_by_rerank_score(candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    candidates.sort(key=lambda x: x.get("rerank_score", 0.0), reverse=True)
+    return candidates
+
+def _rerank_local(question: str, candidates: List[Dict[str, Any]], backend: str) -> List[Dict[str, Any]]:
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
+        return local_rerank(question, candidates, backend=backend)
+    except Exception as e:
+        return _fallback(question, candidates, e, allow_local=False)
+
+def _fallback(question: str, candidates: List[Dict[str, Any]], e: Exception, allow_local: bool = True) -> List[Dict[str, Any]]:
+    """Keep the hybrid order (or use the local scorer) when the reranker call fails."""
+    RERANK_FALLBACKS.inc()
+    if allow_local and RERANKER_FALLBACK == "local":
+        logger.error(f"Reranking failed: {e}. Falling back to local reranker.")
+        return _rerank_local(question, candidates, "local")
+    logger.error(f"Reranking failed: {e}. Falling back to original order.")
+    # Fallback: maintain original order. 
+    # Mark them with a special flag or just copy original score?
+    # Use simple heuristic: map 'score' (original) to 'rerank_score' if available for compatibility
+    for cand in candidates:
+        cand["rerank_score"] = cand.get("score", 0.0) # Fallback to search score
+        cand["rerank_fallback"] = True
+        
+    return candidates
+
+def rerank(question: str, candidates: List[Dict[str, Any]], client=None) -> List[Dict[str, Any]]:
+    """
+    Reranks a list of candidate documents based on their relevance to the question
+    using gpt-4o-mini, or a local CPU backend if RERANKER_BACKEND is "local" or
+    "cross-encoder". LLM scores are cached per (normalized question, uuid); on a partial
+    hit only the uncached candidates are sent to the LLM.
+    
+    Args:
+        question: The user's question.
+        candidates: List of dictionaries, each containing at least 'text'.
+        client: OpenAI client to use. Defaults to the shared process-wide client.
+        
+    Returns:
+        List[Dict]: The candidates list with updated scores and sorted by relevance.
+                    Adds 'rerank_score' to each candidate.
+    """
+    if not candidates:
+        return []
+
+    if RERANKER_BACKEND != "llm":
+        # Local CPU scoring, one batched call in a few milliseconds
+        return _rerank_local(question, candidates, RERANKER_BACKEND)
+
+    # Only candidates without a cached (question, uuid) score go to the LLM
+    pending = _apply_cached_scores(question, candidates)
+    if not pending:
+        return _sort_by_rerank_score(candidates)
+
+    client = client or get_openai_client()
+
+    try:
+        response = call_openai_sync("rerank", lambda: client.chat.completions.create(
+            model=RERANK_MODEL,
+            messages=_build_messages(question, pending),
             response_format={"type": "json_object"},
             temperature=0,
-            timeout=10 # Fail-safe timeout
-        )
-
-        content = response.choices[0].message.content
-        if not content:
-            logger.warning("Reranker returned empty content.")
-            return candidates
-
-        data = json.loads(content)
-        ranking = data.get("ranking", [])
-
-        # Create score map: index (int) -> score (float)
-        score_map = {}
-        for item in ranking:
-            try:
-                idx = int(item.get("i"))
-                score = float(item.get("score"))
-                score_map[idx] = score
-            except (ValueError, TypeError):
-                continue
-
-        # Assign scores to candidates
-        # Note: prompt used 1-based index, cand list is 0-based
-        for i, cand in enumerate(candidates):
-            # Default to 0.0 if not found in LLM output, or keep original weak score behavior?
-            # We'll default to 0.0 effectively dropping it if strictly filtering.
-            # But let's check if we want fallback for items missed?
-            # Usually LLM should return all, but if it skips, it's likely irrelevant.
-            cand["rerank_score"] = score_map.get(i + 1, 0.0)
-
-        # Sort by rerank_score descending
-        candidates.sort(key=lambda x: x["rerank_score"], reverse=True)
-        
-        return candidates
+            **timeout_kwargs(RERANK_TIMEOUT)
+        ))
+        _apply_ranking(response.choices[0].message.content, pending)
+        _store_scores(question, pending)
+        return _sort_by_rerank_score(candidates)
 
     except Exception as e:
-        logger.error(f"Reranking failed: {e}. Falling back to original order.")
-        # Fallback: maintain original order. 
-        # Mark them with a special flag or just copy original score?
-        # Use simple heuristic: map 'score' (original) to 'rerank_score' if available for compatibility
-        for cand in candidates:
-            cand["rerank_score"] = cand.get("score", 0.0) # Fallback to search score
-            cand["rerank_fallback"] = True
-            
-        return candidates
+        return _fallback(question, candidates, e)
+
+async def rerank_async(question: str, candidates: List[Dict[str, Any]], client=None) -> List[Dict[str, Any]]:
+    """Async version of rerank, on the shared AsyncOpenAI client."""
+    if not candidates:
+        return []
+
+    if RERANKER_BACKEND == "cross-encoder":
+        # Model inference is CPU-bound; keep it off the event loop
+        return await asyncio.to_thread(_rerank_local, question, candidates, RERANKER_BACKEND)
+    if RERANKER_BACKEND != "llm":
+        return _rerank_local(question, candidates, RERANKER_BACKEND)
+
+    # Only candidates without a cached (question, uuid) score go to the LLM
+    pending = _apply_cached_scores(question, candidates)
+    if not pending:
+        return _sort_by_rerank_score(candidates)
+
+    client = client or get_async_openai_client()
+
+    try:
+        response = await call_openai("rerank", lambda: client.chat.completions.create(
+            model=RERANK_MODEL,
+            messages=_build_messages(question, pending),
+            response_format={"type": "json_object"},
+            temperature=0,
+            **timeout_kwargs(RERANK_TIMEOUT)
+        ))
+        _apply_ranking(response.choices[0].message.content, pending)
+        _store_scores(question, pending)
+        return _sort_by_rerank_score(candidates)
+
+    except Exception as e:
+        return _fallback(question, candidates, e)
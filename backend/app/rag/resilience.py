@@ -0,0 +1,310 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+
+import openai
+from dotenv import load_dotenv
+
+from .deadline import DeadlineExceeded, current_deadline
+from .semantic_cache import SEMANTIC_CACHE_THRESHOLD
+from .metrics import (
+    UPSTREAM_CALLS, UPSTREAM_RETRIES, UPSTREAM_HEDGES, UPSTREAM_HEDGE_WINS,
+    BREAKER_REJECTIONS, BREAKER_STATE,
+)
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Configuration (the OpenAI SDK's own retries are off while this layer is enabled)
+RESILIENCE_ENABLED = os.getenv("RESILIENCE_ENABLED", "1") == "1"
+
+# Retries of transient errors (connection, timeout, 429, 5xx), with full jitter
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY_MS = float(os.getenv("RETRY_BASE_DELAY_MS", "200"))
+RETRY_MAX_DELAY_MS = float(os.getenv("RETRY_MAX_DELAY_MS", "2000"))
+
+# Hedging: send a duplicate once the original is slower than the endpoint's recent latency quantile
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "1") == "1"
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "50"))
+HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", "0.05"))  # at most this share of calls is hedged
+LATENCY_WINDOW = 500
+
+# Circuit breaker: open after consecutive failed calls (each after its retries), probe again after a cool-down
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_S = float(os.getenv("BREAKER_RESET_S", "30"))
+
+# Semantic cache similarity accepted for a cached answer when generation is unavailable.
+# Same as a normal hit by default: lower, a question about another city or country matches.
+FALLBACK_CACHE_THRESHOLD = float(os.getenv("FALLBACK_CACHE_THRESHOLD", str(SEMANTIC_CACHE_THRESHOLD)))
+
+ENDPOINTS = ("embed", "rerank", "generate")
+
+TRANSIENT_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError,
+                    ConnectionError, TimeoutError)
+
+
+class CircuitOpen(Exception):
+    """The endpoint's circuit breaker is open; the caller should take its cheap path."""
+
+
+def _deadline_passed() -> bool:
+    deadline = current_deadline()
+    return deadline is not None and deadline.expired()
+
+
+def is_transient(e: BaseException) -> bool:
+    return isinstance(e, TRANSIENT_ERRORS) and not isinstance(e, DeadlineExceeded)
+
+
+def upstream_unavailable(e: BaseException) -> bool:
+    """
+    True for errors a fallback should absorb: an open breaker, or transient errors
+    that outlived the retries (not a passed deadline, which ends the request).
+    """
+    return (isinstance(e, CircuitOpen) or is_transient(e)) and not _deadline_passed()
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after BREAKER_FAILURE_THRESHOLD consecutive calls failed with
+    transient errors (a call with its retries counts once).
+    While open, calls are rejected with CircuitOpen; after BREAKER_RESET_S one probe
+    is let through (half-open), and its outcome closes or re-opens the breaker.
+    """
+
+    STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_s: float = BREAKER_RESET_S):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_s = reset_s
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probing = False
+        self._lock = threading.Lock()
+        BREAKER_STATE.set(0, endpoint=name)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning(f"Circuit breaker {self.name}: {self.state} -> {state}")
+            self.state = state
+            BREAKER_STATE.set(self.STATES[state], endpoint=self.name)
+
+    def before_call(self):
+        """Admit a call, or raise CircuitOpen."""
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_s:
+                self._set_state("half_open")
+                self._probing = False
+            if self.state == "open" or (self.state == "half_open" and self._probing):
+                BREAKER_REJECTIONS.inc(endpoint=self.name)
+                raise CircuitOpen(f"OpenAI {self.name} circuit is open")
+            if self.state == "half_open":
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._set_state("closed")
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.opens += 1
+                self.opened_at = time.monotonic()
+                self._set_state("open")
+
+    def release(self):
+        """The call ended without telling us anything about the upstream (cancelled, deadline)."""
+        with self._lock:
+            self._probing = False
+
+
+class Endpoint:
+    """
+    Resilience policy for one OpenAI endpoint: circuit breaker, bounded retries with
+    jitter, and hedging against its own recent latency distribution.
+    """
+
+    def __init__(self, name: str, hedge: bool = HEDGE_ENABLED):
+        self.name = name
+        self.hedge = hedge
+        self.breaker = CircuitBreaker(name)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def latency_quantile(self) -> Optional[float]:
+        """HEDGE_QUANTILE of recent successful call latencies (seconds), once there are enough samples."""
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(HEDGE_QUANTILE * len(ordered)))]
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None to not hedge this call (no data yet, or over HEDGE_MAX_RATE)."""
+        quantile = self.latency_quantile()
+        if not self.hedge or quantile is None:
+            return None
+        if UPSTREAM_HEDGES.value(endpoint=self.name) >= HEDGE_MAX_RATE * UPSTREAM_CALLS.value(endpoint=self.name):
+            return None
+        return max(quantile, HEDGE_MIN_DELAY_MS / 1000)
+
+    def _retry_delay(self, e: Exception, attempt: int) -> float:
+        """Record a failed attempt; the seconds to wait before retrying, or re-raise `e`."""
+        if isinstance(e, DeadlineExceeded) or _deadline_passed():
+            self.breaker.release()
+            raise e
+        if not is_transient(e):
+            # The upstream answered (e.g. a 400), so it is up
+            self.breaker.record_success()
+            raise e
+        delay = random.uniform(0, min(RETRY_MAX_DELAY_MS, RETRY_BASE_DELAY_MS * 2 ** (attempt - 1))) / 1000
+        deadline = current_deadline()
+        # One failure per call, once it gives up; a failed half-open probe re-opens right away
+        if (attempt >= RETRY_MAX_ATTEMPTS or (deadline is not None and deadline.remaining() <= delay)
+                or self.breaker.state == "half_open"):
+            self.breaker.record_failure()
+            raise e
+        UPSTREAM_RETRIES.inc(endpoint=self.name)
+        logger.warning(f"OpenAI {self.name} attempt {attempt} failed: {e}. Retrying in {delay * 1000:.0f}ms.")
+        return delay
+
+    def _succeeded(self, start: float, record_latency: bool = True):
+        self.breaker.record_success()
+        if record_latency:
+            self.latencies.append(time.perf_counter() - start)
+
+    async def call(self, fn: Callable[[], Awaitable[Any]], hedge: bool = True) -> Any:
+        """
+        Run fn(), which starts one OpenAI request, under the breaker with retries.
+        hedge=False for calls whose result must not be duplicated (streams, large batches);
+        their latency (e.g. a stream's time to first byte) is not comparable with the
+        hedged calls', so it is kept out of the window the hedge delay comes from.
+        """
+        UPSTREAM_CALLS.inc(endpoint=self.name)
+        attempt = 0
+        while True:
+            attempt += 1
+            self.breaker.before_call()
+            start = time.perf_counter()
+            try:
+                result = await (self._hedged(fn) if hedge else fn())
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                await asyncio.sleep(self._retry_delay(e, attempt))
+                continue
+            self._succeeded(start, record_latency=hedge)
+            return result
+
+    def call_sync(self, fn: Callable[[], Any]) -> Any:
+        """Blocking version of call for the sync clients (no hedging)."""
+        UPSTREAM_CALLS.inc(endpoint=self.name)
+        attempt = 0
+        while True:
+            attempt += 1
+            self.breaker.before_call()
+            start = time.perf_counter()
+            try:
+                result = fn()
+            except Exception as e:
+                time.sleep(self._retry_delay(e, attempt))
+                continue
+            self._succeeded(start)
+            return result
+
+    async def _hedged(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """First successful response of the original and (if it is slow) one duplicate."""
+        delay = self.hedge_delay()
+        if delay is None:
+            return await fn()
+        original = asyncio.ensure_future(fn())
+        tasks = [original]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                UPSTREAM_HEDGES.inc(endpoint=self.name)
+                tasks.append(asyncio.ensure_future(fn()))
+            error = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not original:
+                            UPSTREAM_HEDGE_WINS.inc(endpoint=self.name)
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                    # The loser's outcome is not needed; don't log it as never retrieved
+                    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    def stats(self) -> dict:
+        calls = UPSTREAM_CALLS.value(endpoint=self.name)
+        hedges = UPSTREAM_HEDGES.value(endpoint=self.name)
+        quantile = self.latency_quantile()
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "opens": self.breaker.opens,
+            "rejections": int(BREAKER_REJECTIONS.value(endpoint=self.name)),
+            "calls": int(calls),
+            "retries": int(UPSTREAM_RETRIES.value(endpoint=self.name)),
+            "hedges": int(hedges),
+            "hedge_wins": int(UPSTREAM_HEDGE_WINS.value(endpoint=self.name)),
+            "hedge_rate": round(hedges / calls, 4) if calls else 0.0,
+            "latency_quantile_ms": round(quantile * 1000, 1) if quantile is not None else None,
+        }
+
+
+_endpoints = {}
+_init_lock = threading.Lock()
+
+
+def get_endpoint(name: str) -> Optional[Endpoint]:
+    """Return the process-wide policy for an OpenAI endpoint, or None if disabled."""
+    if not RESILIENCE_ENABLED:
+        return None
+    if name not in _endpoints:
+        with _init_lock:
+            if name not in _endpoints:
+                _endpoints[name] = Endpoint(name)
+    return _endpoints[name]
+
+
+async def call_openai(name: str, fn: Callable[[], Awaitable[Any]], hedge: bool = True) -> Any:
+    """Run fn() through the endpoint's breaker, retries and hedging (or directly when disabled)."""
+    endpoint = get_endpoint(name)
+    if endpoint is None:
+        return await fn()
+    return await endpoint.call(fn, hedge)
+
+
+def call_openai_sync(name: str, fn: Callable[[], Any]) -> Any:
+    endpoint = get_endpoint(name)
+    if endpoint is None:
+        return fn()
+    return endpoint.call_sync(fn)
+
+
+def resilience_stats() -> Optional[dict]:
+    if not RESILIENCE_ENABLED:
+        return None
+    return {name: get_endpoint(name).stats() for name in ENDPOINTS}
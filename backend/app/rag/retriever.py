@@ -1,117 +1,455 @@
 import os
+import re
+import logging
+from collections import Counter
 import weaviate
-from openai import OpenAI
+from weaviate.exceptions import WeaviateConnectionError, WeaviateGRPCUnavailableError
+from weaviate.util import generate_uuid5
 from dotenv import load_dotenv
-from .reranker import rerank
+from .clients import (
+    get_openai_client, get_weaviate_client, reset_weaviate_client,
+    get_async_openai_client, get_async_weaviate_client, reset_async_weaviate_client,
+)
+from .embedding_cache import get_embedding_cache, normalize_query
+from .embed_batcher import get_embed_batcher
+from .lexical import get_corpus_lexical_index
+from .local_index import get_local_index, get_local_index_async
+from .reranker import rerank, rerank_async
+from .deadline import timeout_kwargs, with_deadline, should_skip_rerank
+from .resilience import call_openai, call_openai_sync
+from .metrics import stage, annotate, THRESHOLD_DROPS
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 COLLECTION_NAME = "KnowledgeDocument"
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# retrieval constants
+TOP_K_CANDIDATES = 10
+RERANK_THRESHOLD = 0.5  # Filter out candidates with low LLM relevance score
+HYBRID_ALPHA = 0.6 # 0.6 = favor vector slightly
+
+# Hybrid search backend: "weaviate" (default) or "local" (in-process NumPy index)
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "weaviate")
+# Extra candidates from the Arabic-normalized BM25 index (Weaviate backend only; 0 = off)
+LEXICAL_CANDIDATES = int(os.getenv("LEXICAL_CANDIDATES", "0"))
+
+# Adaptive reranking: skip the reranker, or rerank only the tail, when the hybrid
+# ranking is already decisive. Gaps are (top1 - top2) / top1 of the hybrid scores.
+ADAPTIVE_RERANK = os.getenv("ADAPTIVE_RERANK", "0") == "1"
+ADAPTIVE_SKIP_GAP = float(os.getenv("ADAPTIVE_SKIP_GAP", "0.35"))
+ADAPTIVE_TAIL_GAP = float(os.getenv("ADAPTIVE_TAIL_GAP", "0.15"))
+
+# Max inputs per embeddings.create request when embedding a batch of queries
+EMBED_REQUEST_MAX = 2048
 
+# Per-decision counters ("full", "tail", "skip")
+ADAPTIVE_RERANK_DECISIONS = Counter()
 
-def get_openai_client():
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY not set in environment")
-    return OpenAI(api_key=api_key)
+_EXPLAIN_RE = re.compile(r"Result Set (vector|keyword)[^:]*:.*?normalized score: ([-\d.eE]+)")
+
+
+def embed_query(query: str, client=None) -> list:
+    """
+    Embed the query using OpenAI text-embedding-3-small.
+    Served from the embedding cache when possible (no round trip on a hit).
+    """
+    clean_query = normalize_query(query)
+    cache = get_embedding_cache()
+    if cache is not None:
+        cached = cache.get(clean_query, EMBEDDING_MODEL)
+        if cached is not None:
+            return cached
 
-def embed_query(query: str) -> list:
-    """Embed the query using OpenAI text-embedding-3-small."""
-    client = get_openai_client()
-    clean_query = query.replace("\n", " ")
-    response = client.embeddings.create(
+    client = client or get_openai_client()
+    response = call_openai_sync("embed", lambda: client.embeddings.create(
         input=[clean_query],
-        model="text-embedding-3-small"
+        model=EMBEDDING_MODEL,
+        **timeout_kwargs()
+    ))
+    vector = response.data[0].embedding
+    if cache is not None:
+        cache.set(clean_query, EMBEDDING_MODEL, vector)
+    return vector
+
+async def embed_query_async(query: str, client=None) -> list:
+    """Async version of embed_query (the cache's SQLite tier is read and written off the event loop)."""
+    clean_query = normalize_query(query)
+    cache = get_embedding_cache()
+    if cache is not None:
+        cached = (await cache.get_many_async([clean_query], EMBEDDING_MODEL)).get(clean_query)
+        if cached is not None:
+            return cached
+
+    client = client or get_async_openai_client()
+    batcher = get_embed_batcher(EMBEDDING_MODEL)
+    if batcher is not None:
+        # Coalesced with other in-flight queries into one batched request
+        vector = await with_deadline(batcher.embed(clean_query, client))
+    else:
+        response = await call_openai("embed", lambda: client.embeddings.create(
+            input=[clean_query],
+            model=EMBEDDING_MODEL,
+            **timeout_kwargs()
+        ))
+        vector = response.data[0].embedding
+    if cache is not None:
+        await cache.set_many_async({clean_query: vector}, EMBEDDING_MODEL)
+    return vector
+
+async def embed_queries_async(queries: list, client=None) -> list:
+    """
+    Embed many queries, returning one vector per query in input order.
+    Cached queries are served from the embedding cache; the rest (deduplicated)
+    go out in as few embeddings.create requests as possible.
+    """
+    clean_queries = [normalize_query(q) for q in queries]
+    cache = get_embedding_cache()
+    vectors = {}
+    if cache is not None:
+        vectors = await cache.get_many_async(list(dict.fromkeys(clean_queries)), EMBEDDING_MODEL)
+
+    missing = list(dict.fromkeys(q for q in clean_queries if q not in vectors))
+    if missing:
+        client = client or get_async_openai_client()
+        for start in range(0, len(missing), EMBED_REQUEST_MAX):
+            chunk = missing[start:start + EMBED_REQUEST_MAX]
+            # Not hedged: batch latency is not comparable with the single-query latencies
+            response = await call_openai(
+                "embed", lambda: client.embeddings.create(input=chunk, model=EMBEDDING_MODEL, **timeout_kwargs()), hedge=False
+            )
+            data = sorted(response.data, key=lambda d: d.index)
+            fresh = {clean_query: item.embedding for clean_query, item in zip(chunk, data)}
+            vectors.update(fresh)
+            if cache is not None:
+                await cache.set_many_async(fresh, EMBEDDING_MODEL)
+    return [vectors[q] for q in clean_queries]
+
+def _hybrid_kwargs(query: str, query_vector: list, limit: int, alpha: float = None, include_vector: bool = False) -> dict:
+    kwargs = dict(
+        query=query,
+        vector=query_vector,
+        alpha=HYBRID_ALPHA if alpha is None else alpha,
+        limit=limit, # Retrieve more for reranking
+        return_metadata=weaviate.classes.query.MetadataQuery(score=True, explain_score=True, distance=True, certainty=True)
     )
-    return response.data[0].embedding
+    if include_vector:
+        kwargs["include_vector"] = True
+    return kwargs
 
-def retrieve(query: str, top_k: int = 3) -> list:
+def hybrid_search(weaviate_client, query: str, query_vector: list, limit: int, alpha: float = None):
     """
-    Retrieve relevant documents from Weaviate and rerank them.
-    Returns list of dicts with text, question, section, source, score.
+    Run the hybrid (vector + keyword) query against the shared Weaviate client.
+    On a connection failure the shared client is dropped and the query is retried
+    once on a fresh connection.
     """
-    # retrieval constants
-    TOP_K_CANDIDATES = 10
-    RERANK_THRESHOLD = 0.5  # Filter out candidates with low LLM relevance score
+    def _query(client):
+        collection = client.collections.get(COLLECTION_NAME)
+        return collection.query.hybrid(**_hybrid_kwargs(query, query_vector, limit, alpha))
 
-    # Connect to Weaviate
-    weaviate_client = weaviate.connect_to_local(port=8080)
-    
     try:
-        # Embed the query
-        query_vector = embed_query(query)
-        
-        # Perform Hybrid Search (Vector + Keyword)
-        collection = weaviate_client.collections.get(COLLECTION_NAME)
-        response = collection.query.hybrid(
-            query=query,
-            vector=query_vector,
-            alpha=0.6, # 0.6 = favor vector slightly
-            limit=TOP_K_CANDIDATES, # Retrieve more for reranking
-            return_metadata=weaviate.classes.query.MetadataQuery(score=True, explain_score=True, distance=True, certainty=True)
-        )
-        
-        # Convert objects to candidates list
-        candidates = []
-        if response.objects:
-            for obj in response.objects:
-                candidates.append({
-                    "text": obj.properties.get("text", ""),
-                    "question": obj.properties.get("question", ""),
-                    "section": obj.properties.get("section", ""),
-                    "source": obj.properties.get("source", ""),
-                    "score": obj.metadata.score, # Keep hybrid score for reference/fallback
-                    "certainty": obj.metadata.certainty,
-                    "uuid": str(obj.uuid)
-                })
-
-        print(f"DEBUG: retrieval: hybrid top_k={TOP_K_CANDIDATES} found={len(candidates)}")
-        
-        if not candidates:
-            return []
+        return _query(weaviate_client)
+    except (WeaviateConnectionError, WeaviateGRPCUnavailableError) as e:
+        logger.warning(f"Weaviate query failed: {e}. Reconnecting and retrying once.")
+        reset_weaviate_client()
+        return _query(get_weaviate_client())
+
+async def hybrid_search_async(weaviate_client, query: str, query_vector: list, limit: int, include_vector: bool = False):
+    """Async version of hybrid_search, on the shared async Weaviate client."""
+    async def _query(client):
+        collection = client.collections.get(COLLECTION_NAME)
+        return await collection.query.hybrid(**_hybrid_kwargs(query, query_vector, limit, include_vector=include_vector))
+
+    try:
+        return await _query(weaviate_client)
+    except (WeaviateConnectionError, WeaviateGRPCUnavailableError) as e:
+        logger.warning(f"Weaviate query failed: {e}. Reconnecting and retrying once.")
+        await reset_async_weaviate_client()
+        return await _query(await get_async_weaviate_client())
+
+def _to_candidates(response) -> list:
+    """Convert Weaviate hybrid objects to candidate dicts."""
+    candidates = []
+    if response.objects:
+        for obj in response.objects:
+            candidates.append({
+                "text": obj.properties.get("text", ""),
+                "question": obj.properties.get("question", ""),
+                "section": obj.properties.get("section", ""),
+                "source": obj.properties.get("source", ""),
+                "score": obj.metadata.score, # Keep hybrid score for reference/fallback
+                "certainty": obj.metadata.certainty,
+                "uuid": str(obj.uuid),
+                **_parse_explain_score(obj.metadata.explain_score)
+            })
+            vector = getattr(obj, "vector", None)
+            if isinstance(vector, dict):
+                vector = vector.get("default")
+            if vector:
+                candidates[-1]["vector"] = vector
+    return candidates
+
+def _parse_explain_score(explain: str) -> dict:
+    """Extract the normalized vector/keyword halves from Weaviate's hybrid explain_score."""
+    parts = {"vector_score": None, "keyword_score": None}
+    for kind, value in _EXPLAIN_RE.findall(explain or ""):
+        try:
+            parts[f"{kind}_score"] = float(value)
+        except ValueError:
+            continue
+    return parts
+
+def _add_lexical_candidates(query: str, candidates: list, alpha: float = HYBRID_ALPHA) -> list:
+    """
+    Add top Arabic-normalized BM25 hits that the Weaviate hybrid query missed
+    (e.g. differing only in alef forms, taa marbuta or harakat).
+    They get the keyword share of the fused score, since their vector part is unknown.
+    """
+    hits = get_corpus_lexical_index().search(query, LEXICAL_CANDIDATES + len(candidates))
+    if not hits:
+        return candidates
+
+    seen = {c["question"] for c in candidates}
+    top_score = hits[0][1]
+    added = 0
+    for doc, score in hits:
+        if added >= LEXICAL_CANDIDATES:
+            break
+        if doc["metadata"]["question"] in seen:
+            continue
+        candidates.append({
+            "text": doc["text"],
+            "question": doc["metadata"]["question"],
+            "section": doc["metadata"]["section"],
+            "source": doc["metadata"]["source"],
+            "score": (1 - alpha) * score / top_score,
+            "certainty": None,
+            "uuid": str(generate_uuid5(doc["id"])),
+            "lexical_only": True
+        })
+        added += 1
+
+    candidates.sort(key=lambda c: c["score"] or 0.0, reverse=True)
+    return candidates
+
+def rerank_decision(candidates: list) -> tuple:
+    """
+    Decide how much reranking the hybrid ranking needs.
+    Returns (decision, signals) where decision is "skip" (top hit is decisive and both
+    halves agree), "tail" (top hit is clearly ahead; rerank only the rest) or "full".
+    """
+    scores = [c.get("score") or 0.0 for c in candidates]
+    top1 = scores[0]
+    top2 = scores[1] if len(scores) > 1 else 0.0
+    margin = top1 - top2
+    gap = margin / top1 if top1 > 0 else 0.0
+
+    # Does the top hit also lead both the vector and the keyword half?
+    # (a document missing from one half's result set counts as 0 there)
+    vector = [c.get("vector_score") for c in candidates]
+    keyword = [c.get("keyword_score") for c in candidates]
+    agreement = None
+    if any(v is not None for v in vector + keyword):
+        vector = [v or 0.0 for v in vector]
+        keyword = [k or 0.0 for k in keyword]
+        agreement = vector[0] >= max(vector) and keyword[0] >= max(keyword)
+
+    if gap >= ADAPTIVE_SKIP_GAP and agreement:
+        decision = "skip"
+    elif gap >= ADAPTIVE_TAIL_GAP:
+        decision = "tail"
+    else:
+        decision = "full"
+    return decision, {"margin": round(margin, 4), "gap": round(gap, 4), "agreement": agreement}
 
-        # Rerank candidates
-        reranked_candidates = rerank(query, candidates)
+def _record_decision(decision: str, signals: dict):
+    ADAPTIVE_RERANK_DECISIONS[decision] += 1
+    logger.info(f"adaptive_rerank: decision={decision} margin={signals['margin']} gap={signals['gap']} agreement={signals['agreement']}")
+
+def adaptive_rerank_stats() -> dict:
+    total = sum(ADAPTIVE_RERANK_DECISIONS.values())
+    return {
+        "enabled": ADAPTIVE_RERANK,
+        "full": ADAPTIVE_RERANK_DECISIONS["full"],
+        "tail": ADAPTIVE_RERANK_DECISIONS["tail"],
+        "skip": ADAPTIVE_RERANK_DECISIONS["skip"],
+        "skip_rate": round(ADAPTIVE_RERANK_DECISIONS["skip"] / total, 4) if total else 0.0,
+    }
+
+def _trust_top(candidates: list) -> list:
+    """Keep the decisive top hit as is (hybrid score, no threshold)."""
+    candidates[0]["rerank_trusted"] = True
+    return candidates[:1]
+
+def _trust_hybrid_order(candidates: list) -> list:
+    """Skip the rerank: keep all candidates in hybrid order, no threshold (_select_results slices to top_k)."""
+    for cand in candidates:
+        cand["rerank_trusted"] = True
+    return candidates
+
+def _rerank_adaptive(query: str, candidates: list, openai_client) -> list:
+    if not ADAPTIVE_RERANK:
+        return rerank(query, candidates, client=openai_client)
+    decision, signals = rerank_decision(candidates)
+    _record_decision(decision, signals)
+    if decision == "skip":
+        return _trust_hybrid_order(candidates)
+    if decision == "tail":
+        return _trust_top(candidates) + rerank(query, candidates[1:], client=openai_client)
+    return rerank(query, candidates, client=openai_client)
+
+async def _rerank_adaptive_async(query: str, candidates: list, openai_client) -> list:
+    if not ADAPTIVE_RERANK:
+        return await rerank_async(query, candidates, client=openai_client)
+    decision, signals = rerank_decision(candidates)
+    _record_decision(decision, signals)
+    if decision == "skip":
+        return _trust_hybrid_order(candidates)
+    if decision == "tail":
+        return _trust_top(candidates) + await rerank_async(query, candidates[1:], client=openai_client)
+    return await rerank_async(query, candidates, client=openai_client)
+
+def _select_results(reranked_candidates: list, top_k: int, threshold: float = None) -> list:
+    """Apply the rerank threshold (unless the reranker fell back) and slice to top_k."""
+    threshold = RERANK_THRESHOLD if threshold is None else threshold
+    # Check if fallback occurred (if 'rerank_fallback' is present and True)
+    is_fallback = any(c.get('rerank_fallback') for c in reranked_candidates)
+    top_rerank_score = reranked_candidates[0].get('rerank_score', 0.0) if reranked_candidates else 0.0
+    
+    logger.debug(f"rerank: top_final={top_k} top_rerank_score={top_rerank_score:.4f} fallback={is_fallback}")
+
+    final_results = []
+    for cand in reranked_candidates:
+        r_score = cand.get('rerank_score', 0.0)
         
-        # Check if fallback occurred (if 'rerank_fallback' is present and True)
-        is_fallback = any(c.get('rerank_fallback') for c in reranked_candidates)
-        top_rerank_score = reranked_candidates[0].get('rerank_score', 0.0) if reranked_candidates else 0.0
+        # If fallback logic was triggered inside reranker, we trust original scores/order
+        # But the prompt said: "If reranker score < THRESHOLD, drop candidate"
+        # It also said "stable behavior if reranker fails (fallback works)"
+        # If fallback used, we probably shouldn't filter by RERANK_THRESHOLD which defaults to 0.0 in fallback?
+        # In reranker.py fallback, I mapped original score to rerank_score.
+        # Hybrid scores are unbounded (can be > 1 or < 0 or small).
         
-        print(f"DEBUG: rerank: enabled top_final={top_k} top_rerank_score={top_rerank_score:.4f} fallback={is_fallback}")
-
-        final_results = []
-        for cand in reranked_candidates:
-            r_score = cand.get('rerank_score', 0.0)
-            
-            # If fallback logic was triggered inside reranker, we trust original scores/order
-            # But the prompt said: "If reranker score < THRESHOLD, drop candidate"
-            # It also said "stable behavior if reranker fails (fallback works)"
-            # If fallback used, we probably shouldn't filter by RERANK_THRESHOLD which defaults to 0.0 in fallback?
-            # In reranker.py fallback, I mapped original score to rerank_score.
-            # Hybrid scores are unbounded (can be > 1 or < 0 or small).
-            
-            if is_fallback:
-                # In fallback, just take them all (or trust hybrid order)
+        if is_fallback or cand.get('rerank_trusted'):
+            # In fallback (or for a decisive top hit), just take them (trust hybrid order)
+            final_results.append(cand)
+        else:
+            if r_score >= threshold:
+                # Update the visible score to be the reranker score
+                cand['score'] = r_score 
                 final_results.append(cand)
             else:
-                if r_score >= RERANK_THRESHOLD:
-                    # Update the visible score to be the reranker score
-                    cand['score'] = r_score 
-                    final_results.append(cand)
-        
-        # Slice to final top_k
-        final_results = final_results[:top_k]
-        
-        print(f"DEBUG: returned_sources={len(final_results)}")
-        
-        # Strip internal keys before returning if needed, but extra keys usually fine
-        # Ensure 'score' is float and rounded
-        for res in final_results:
-            if isinstance(res['score'], float):
-                res['score'] = round(res['score'], 4)
+                THRESHOLD_DROPS.inc()
+    
+    # Slice to final top_k
+    final_results = final_results[:top_k]
+    
+    logger.debug(f"returned_sources={len(final_results)}")
+    annotate(candidates=len(reranked_candidates), contexts=len(final_results), rerank_fallback=is_fallback)
+    
+    # Strip internal keys before returning if needed, but extra keys usually fine
+    # Ensure 'score' is float and rounded
+    for res in final_results:
+        if isinstance(res['score'], float):
+            res['score'] = round(res['score'], 4)
 
-        return final_results
-        
-    finally:
-        weaviate_client.close()
+    return final_results
+
+def retrieve(query: str, top_k: int = 3, weaviate_client=None, openai_client=None, query_vector: list = None,
+             alpha: float = None, num_candidates: int = None, rerank_enabled: bool = True,
+             threshold: float = None) -> list:
+    """
+    Retrieve relevant documents (Weaviate, or the local index if RETRIEVER_BACKEND=local)
+    and rerank them.
+    Clients are injected by the caller; when omitted the process-wide shared
+    clients are used. Pass query_vector if the query was already embedded.
+    alpha, num_candidates and threshold override HYBRID_ALPHA, TOP_K_CANDIDATES and
+    RERANK_THRESHOLD; rerank_enabled=False returns the hybrid order (for evaluation).
+    Returns list of dicts with text, question, section, source, score.
+    """
+    openai_client = openai_client or get_openai_client()
+    alpha = HYBRID_ALPHA if alpha is None else alpha
+    num_candidates = num_candidates or TOP_K_CANDIDATES
+
+    # Embed the query
+    if query_vector is None:
+        with stage("embed"):
+            query_vector = embed_query(query, client=openai_client)
+    
+    # Perform Hybrid Search (Vector + Keyword)
+    with stage("hybrid"):
+        if RETRIEVER_BACKEND == "local":
+            candidates = get_local_index().search(query, query_vector, alpha, num_candidates)
+        else:
+            weaviate_client = weaviate_client or get_weaviate_client()
+            response = hybrid_search(weaviate_client, query, query_vector, num_candidates, alpha)
+            candidates = _to_candidates(response)
+            if LEXICAL_CANDIDATES > 0:
+                candidates = _add_lexical_candidates(query, candidates, alpha)
+
+    logger.debug(f"retrieval: hybrid backend={RETRIEVER_BACKEND} top_k={num_candidates} found={len(candidates)}")
+    
+    if not candidates:
+        return []
+    if not rerank_enabled:
+        return candidates[:top_k]
+
+    # Rerank candidates
+    with stage("rerank"):
+        reranked_candidates = _rerank_adaptive(query, candidates, openai_client)
+    return _select_results(reranked_candidates, top_k, threshold)
+
+async def search_candidates_async(query: str, query_vector: list, weaviate_client=None, include_vector: bool = False) -> list:
+    """
+    Hybrid search half of retrieve_async: candidates before reranking.
+    include_vector=True adds each candidate's document vector under "vector".
+    """
+    with stage("hybrid"):
+        if RETRIEVER_BACKEND == "local":
+            # In-process: one matrix-vector product, no network hop
+            local_index = await get_local_index_async()
+            candidates = local_index.search(query, query_vector, HYBRID_ALPHA, TOP_K_CANDIDATES, include_vector)
+        else:
+            weaviate_client = weaviate_client or await get_async_weaviate_client()
+            response = await with_deadline(
+                hybrid_search_async(weaviate_client, query, query_vector, TOP_K_CANDIDATES, include_vector)
+            )
+            candidates = _to_candidates(response)
+            if LEXICAL_CANDIDATES > 0:
+                candidates = _add_lexical_candidates(query, candidates)
+
+    logger.debug(f"retrieval: hybrid backend={RETRIEVER_BACKEND} top_k={TOP_K_CANDIDATES} found={len(candidates)}")
+    return candidates
+
+async def rerank_candidates_async(query: str, candidates: list, top_k: int = 3, openai_client=None) -> list:
+    """
+    Rerank half of retrieve_async: rerank candidates, apply the threshold and slice to top_k.
+    Keeps the hybrid order instead when the request deadline is too close for a rerank call.
+    """
+    if not candidates:
+        return []
+    if should_skip_rerank():
+        return _select_results(_trust_hybrid_order(candidates), top_k)
+    openai_client = openai_client or get_async_openai_client()
+    with stage("rerank"):
+        reranked_candidates = await _rerank_adaptive_async(query, candidates, openai_client)
+    return _select_results(reranked_candidates, top_k)
+
+async def retrieve_async(query: str, top_k: int = 3, weaviate_client=None, openai_client=None, query_vector: list = None) -> list:
+    """
+    Async version of retrieve, built on AsyncOpenAI and the async Weaviate client.
+    Used by the API so in-flight requests don't hold threadpool workers.
+    """
+    openai_client = openai_client or get_async_openai_client()
+
+    # Embed the query
+    if query_vector is None:
+        with stage("embed"):
+            query_vector = await embed_query_async(query, client=openai_client)
+    
+    # Perform Hybrid Search (Vector + Keyword)
+    candidates = await search_candidates_async(query, query_vector, weaviate_client)
 
+    # Rerank candidates
+    return await rerank_candidates_async(query, candidates, top_k, openai_client)
@@ -0,0 +1,151 @@
+import os
+import time
+import logging
+import threading
+from typing import Any, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from .index_version import current_version
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "1"
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1024"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_POLICY = os.getenv("SEMANTIC_CACHE_POLICY", "lru")  # "lru" or "lfu"
+
+
+class SemanticCache:
+    """
+    In-process semantic answer cache.
+    Query vectors are kept L2-normalized in one contiguous float32 matrix, so a lookup
+    is a single matrix-vector product (cosine similarity) over all live entries.
+    Entries expire after `ttl`, are evicted by LRU or LFU when full, and the whole
+    cache is cleared when the index version changes (re-index).
+    """
+
+    def __init__(self, maxsize: int = SEMANTIC_CACHE_SIZE, ttl: float = SEMANTIC_CACHE_TTL,
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD, policy: str = SEMANTIC_CACHE_POLICY):
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f"Unknown semantic cache policy: {policy}")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._vectors = None  # (maxsize, dim) float32, allocated on first insert
+        self._expires_at = np.zeros(maxsize, dtype=np.float64)
+        self._last_used = np.zeros(maxsize, dtype=np.float64)
+        self._use_count = np.zeros(maxsize, dtype=np.int64)
+        self._live = np.zeros(maxsize, dtype=bool)
+        self._payloads = [None] * maxsize
+        self._version = current_version()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm > 0 else v
+
+    def _check_version(self):
+        version = current_version()
+        if version != self._version:
+            logger.info("Index version changed; clearing semantic cache.")
+            self._clear_locked()
+            self._version = version
+            self.invalidations += 1
+
+    def _clear_locked(self):
+        self._live[:] = False
+        self._payloads = [None] * self.maxsize
+
+    def get(self, vector, threshold: float = None) -> Optional[Any]:
+        """Return the payload of the most similar live entry if its cosine similarity >= threshold."""
+        threshold = self.threshold if threshold is None else threshold
+        with self._lock:
+            self._check_version()
+            if self._vectors is None or not self._live.any():
+                self.misses += 1
+                return None
+
+            now = time.monotonic()
+            self._live &= self._expires_at > now
+
+            sims = self._vectors @ self._normalize(vector)
+            sims[~self._live] = -np.inf
+            best = int(np.argmax(sims))
+            if sims[best] < threshold:
+                self.misses += 1
+                return None
+
+            self._last_used[best] = now
+            self._use_count[best] += 1
+            self.hits += 1
+            return self._payloads[best]
+
+    def set(self, vector, payload: Any):
+        with self._lock:
+            self._check_version()
+            v = self._normalize(vector)
+            if self._vectors is None:
+                self._vectors = np.zeros((self.maxsize, v.shape[0]), dtype=np.float32)
+
+            now = time.monotonic()
+            self._live &= self._expires_at > now
+
+            free = np.flatnonzero(~self._live)
+            if free.size:
+                slot = int(free[0])
+            else:
+                score = self._last_used if self.policy == "lru" else self._use_count
+                slot = int(np.argmin(score))
+                self.evictions += 1
+
+            self._vectors[slot] = v
+            self._payloads[slot] = payload
+            self._expires_at[slot] = now + self.ttl
+            self._last_used[slot] = now
+            self._use_count[slot] = 0
+            self._live[slot] = True
+
+    def clear(self):
+        with self._lock:
+            self._clear_locked()
+
+    def stats(self) -> dict:
+        return {
+            "size": int(self._live.sum()),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "threshold": self.threshold,
+            "policy": self.policy,
+        }
+
+
+_semantic_cache = None
+_init_lock = threading.Lock()
+
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """Return the process-wide semantic cache, or None if disabled."""
+    global _semantic_cache
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    if _semantic_cache is None:
+        with _init_lock:
+            if _semantic_cache is None:
+                _semantic_cache = SemanticCache()
+    return _semantic_cache
@@ -0,0 +1,167 @@
+import os
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from .cache import TTLCache
+from .index_version import current_version
+from .deadline import with_deadline
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+SESSIONS_ENABLED = os.getenv("SESSIONS_ENABLED", "1") == "1"
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))  # idle seconds before a session expires
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "4"))
+SESSION_MAX_ANSWER_CHARS = int(os.getenv("SESSION_MAX_ANSWER_CHARS", "1000"))
+SESSION_MAX_CANDIDATES = int(os.getenv("SESSION_MAX_CANDIDATES", "10"))
+# Passages (fields + float16 vector) shared by all sessions, which keep only uuids
+SESSION_POOL_SIZE = int(os.getenv("SESSION_POOL_SIZE", "5000"))
+# Follow-up-to-passage cosine a cached candidate needs to be reused. This is only
+# a prefilter: reused candidates still go through the reranker, which judges relevance. With
+# text-embedding-3 models, relevant question/passage pairs mostly score ~0.4-0.7 and unrelated
+# ones ~0.1-0.3, so 0.5 drops passages from another topic (forcing a fresh search) while
+# keeping those that may answer the follow-up.
+SESSION_REUSE_THRESHOLD = float(os.getenv("SESSION_REUSE_THRESHOLD", "0.5"))
+
+CANDIDATE_FIELDS = ("text", "question", "section", "source", "uuid")
+
+
+def _normalize(vector) -> np.ndarray:
+    v = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm > 0 else v
+
+
+class CandidatePool:
+    """
+    Retrieved passages shared by all sessions: uuid -> (candidate fields, L2-normalized
+    float16 vector), per index version. Sessions asking about the same documents share
+    one copy, so the pool is bounded by the corpus size as well as by SESSION_POOL_SIZE.
+    """
+
+    def __init__(self, maxsize: int = SESSION_POOL_SIZE, ttl: float = SESSION_TTL):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def add(self, version: str, candidate: dict, vector):
+        fields = {field: candidate.get(field, "") for field in CANDIDATE_FIELDS}
+        self.entries.set(f"{version}:{candidate['uuid']}", (fields, _normalize(vector).astype(np.float16)))
+
+    def get(self, version: str, uuid: str):
+        return self.entries.get(f"{version}:{uuid}")
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class Session:
+    """
+    One conversation: its recent turns (answers truncated) and the uuids of the
+    candidates of its last retrieval (the passages themselves are in the CandidatePool).
+    Size is bounded by SESSION_MAX_TURNS, SESSION_MAX_ANSWER_CHARS and SESSION_MAX_CANDIDATES.
+    """
+
+    __slots__ = ("turns", "candidate_uuids", "version", "lock")
+
+    def __init__(self):
+        self.turns = deque(maxlen=SESSION_MAX_TURNS)
+        self.candidate_uuids = []
+        self.version = None
+        self.lock = asyncio.Lock()
+
+    def history(self) -> List[Tuple[str, str]]:
+        return list(self.turns)
+
+    def retrieval_query(self, question: str) -> str:
+        """What a fresh search for this turn uses: the last user question plus this one."""
+        if not self.turns:
+            return question
+        return f"{self.turns[-1][0]} {question}"
+
+    def add_turn(self, question: str, answer: str):
+        self.turns.append((question, answer[:SESSION_MAX_ANSWER_CHARS]))
+
+    def set_candidates(self, candidates: list, pool: CandidatePool):
+        """Keep the candidates that came with a vector and a uuid (the vector is removed from the candidate dict)."""
+        self.version = current_version()
+        self.candidate_uuids = []
+        for cand in candidates:
+            vector = cand.pop("vector", None)
+            if vector is not None and cand.get("uuid") and len(self.candidate_uuids) < SESSION_MAX_CANDIDATES:
+                pool.add(self.version, cand, vector)
+                self.candidate_uuids.append(cand["uuid"])
+
+    def match(self, pool: CandidatePool, query_vector, top_k: int, threshold: float = SESSION_REUSE_THRESHOLD) -> list:
+        """Cached candidates at least `threshold` similar to the query, best first (to be reranked)."""
+        if self.version != current_version():
+            return []
+        entries = [entry for entry in (pool.get(self.version, uuid) for uuid in self.candidate_uuids) if entry is not None]
+        if not entries:
+            return []
+        similarities = np.stack([vector for _, vector in entries]).astype(np.float32) @ _normalize(query_vector)
+        order = [i for i in np.argsort(-similarities) if similarities[i] >= threshold][:top_k]
+        return [{**entries[i][0], "score": round(float(similarities[i]), 4)} for i in order]
+
+
+class SessionStore:
+    """Bounded LRU of sessions; a session expires SESSION_TTL seconds after its last turn."""
+
+    def __init__(self, maxsize: int = SESSION_MAX, ttl: float = SESSION_TTL):
+        self.sessions = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.pool = CandidatePool(ttl=ttl)
+        self.reused = 0
+        self.retrieved = 0
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Session:
+        """The live session for this id; a new empty one is stored right away, so concurrent turns share it."""
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = Session()
+                self.sessions.set(session_id, session)
+        return session
+
+    def save(self, session_id: str, session: Session):
+        self.sessions.set(session_id, session)
+
+    def stats(self) -> dict:
+        return {**self.sessions.stats(), "pool_size": len(self.pool), "reused": self.reused, "retrieved": self.retrieved}
+
+
+@asynccontextmanager
+async def session_turn(session: Optional[Session]):
+    """Hold a session for one turn, so the turns of a conversation run one at a time."""
+    if session is None:
+        yield None
+        return
+    await with_deadline(session.lock.acquire())
+    try:
+        yield session
+    finally:
+        session.lock.release()
+
+
+_session_store = None
+_init_lock = threading.Lock()
+
+
+def get_session_store() -> Optional[SessionStore]:
+    """Return the process-wide session store, or None if disabled."""
+    global _session_store
+    if not SESSIONS_ENABLED:
+        return None
+    if _session_store is None:
+        with _init_lock:
+            if _session_store is None:
+                _session_store = SessionStore()
+    return _session_store
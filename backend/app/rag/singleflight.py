@@ -0,0 +1,42 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one execution.
+    The first caller starts the work as its own task; every caller with the same key
+    that arrives while it is running awaits that task and gets the same result or
+    exception. Nothing is kept once the task completes.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.executions = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+            self.executions += 1
+        else:
+            self.shared += 1
+        # shield: one caller disconnecting must not cancel the work for the others
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Callers may have stopped waiting (disconnect, deadline); mark the exception as seen
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "executions": self.executions,
+            "shared": self.shared,
+            "in_flight": len(self._inflight),
+        }
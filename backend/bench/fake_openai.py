@@ -0,0 +1,129 @@
+import re
+import json
+import time
+import base64
+import asyncio
+from functools import lru_cache
+from typing import Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.rag.lexical import tokenize
+from bench.fixtures import LatencyModel, fake_embedding
+
+_CANDIDATE_RE = re.compile(r"^\[(\d+)\] (.*)$", re.MULTILINE)
+_QUESTION_RE = re.compile(r"^السؤال: (.*)$", re.MULTILINE)
+
+# Number of streamed chunks per answer
+STREAM_CHUNKS = 12
+
+
+def _rerank_content(prompt: str) -> str:
+    """Reranker reply: each numbered candidate scored by how many question terms it contains."""
+    match = _QUESTION_RE.search(prompt)
+    question_terms = set(tokenize(match.group(1))) if match else set()
+    ranking = []
+    for idx, text in _CANDIDATE_RE.findall(prompt):
+        overlap = len(question_terms & set(tokenize(text))) / len(question_terms) if question_terms else 0.0
+        ranking.append({"i": int(idx), "score": round(min(1.0, overlap * 1.2), 2)})
+    return json.dumps({"ranking": ranking}, ensure_ascii=False)
+
+
+def _answer_content(prompt: str) -> str:
+    """Generator reply: the opening of the first context, like a short extractive answer."""
+    match = _CANDIDATE_RE.search(prompt)
+    return match.group(2)[:400] if match else "لا تتوفر المعلومة في السياق."
+
+
+@lru_cache(maxsize=4096)
+def _encoded_embedding(text: str, encoding_format: str):
+    """Embedding payload for one text, memoized so the fake server isn't the bottleneck."""
+    vector = fake_embedding(text)
+    if encoding_format == "base64":
+        return base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+    return vector.tolist()
+
+
+def _completion(model: str, content: str) -> dict:
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def _chunk(model: str, delta: dict, finish_reason=None) -> str:
+    payload = {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def create_app(latency: Dict[str, LatencyModel], token_interval_ms: float = 0.0) -> FastAPI:
+    """
+    Fake OpenAI API (/v1/embeddings, /v1/chat/completions) with configurable latency.
+    latency keys: "embed", "rerank" (json_object completions) and "generate"
+    (time to first token when streaming).
+    """
+    app = FastAPI()
+    counters = {"embed": 0, "rerank": 0, "generate": 0}
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        counters["embed"] += 1
+        await asyncio.sleep(latency["embed"].sample())
+        encoding_format = body.get("encoding_format") or "float"
+        data = [
+            {"object": "embedding", "index": i, "embedding": _encoded_embedding(text, encoding_format)}
+            for i, text in enumerate(texts)
+        ]
+        return JSONResponse({
+            "object": "list", "data": data, "model": body.get("model", ""),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "")
+        prompt = body["messages"][-1]["content"]
+
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            counters["rerank"] += 1
+            await asyncio.sleep(latency["rerank"].sample())
+            return JSONResponse(_completion(model, _rerank_content(prompt)))
+
+        counters["generate"] += 1
+        content = _answer_content(prompt)
+        if not body.get("stream"):
+            await asyncio.sleep(latency["generate"].sample() + token_interval_ms / 1000.0 * STREAM_CHUNKS)
+            return JSONResponse(_completion(model, content))
+
+        async def chunks():
+            await asyncio.sleep(latency["generate"].sample())
+            yield _chunk(model, {"role": "assistant", "content": ""})
+            step = max(1, len(content) // STREAM_CHUNKS)
+            for start in range(0, len(content), step):
+                yield _chunk(model, {"content": content[start:start + step]})
+                if token_interval_ms:
+                    await asyncio.sleep(token_interval_ms / 1000.0)
+            yield _chunk(model, {}, finish_reason="stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    @app.get("/counters")
+    def get_counters():
+        return counters
+
+    return app
@@ -0,0 +1,50 @@
+import asyncio
+import types
+
+from app.rag.local_index import LocalHybridIndex
+from bench.fixtures import LatencyModel
+
+
+class _FakeQuery:
+    def __init__(self, index: LocalHybridIndex, latency: LatencyModel):
+        self.index = index
+        self.latency = latency
+
+    async def hybrid(self, query, vector, alpha, limit, return_metadata=None, include_vector=False, **kwargs):
+        await asyncio.sleep(self.latency.sample())
+        objects = []
+        for rank, cand in enumerate(self.index.search(query, vector, alpha, limit, include_vector)):
+            # Same explain_score shape as Weaviate's relativeScoreFusion
+            explain = (
+                f"\nHybrid (Result Set vector,hybridVector) Document {cand['uuid']}: "
+                f"original score {cand['certainty']:.6f}, normalized score: {cand['vector_score']:.6f}"
+                f"\nHybrid (Result Set keyword,bm25) Document {cand['uuid']}: "
+                f"original score 0, normalized score: {cand['keyword_score']:.6f}"
+            )
+            objects.append(types.SimpleNamespace(
+                uuid=cand["uuid"],
+                properties={k: cand[k] for k in ("text", "question", "section", "source")},
+                metadata=types.SimpleNamespace(
+                    score=cand["score"], certainty=cand["certainty"],
+                    distance=2 * (1 - cand["certainty"]), explain_score=explain,
+                ),
+                vector={"default": cand["vector"].tolist()} if include_vector else {},
+            ))
+        return types.SimpleNamespace(objects=objects)
+
+
+class FakeAsyncWeaviateClient:
+    """
+    Stand-in for weaviate.WeaviateAsyncClient serving hybrid queries from an
+    in-memory index over the fixtures, with a configurable latency per query.
+    """
+
+    def __init__(self, index: LocalHybridIndex, latency: LatencyModel):
+        query = _FakeQuery(index, latency)
+        self.collections = types.SimpleNamespace(get=lambda name: types.SimpleNamespace(query=query))
+
+    def is_connected(self) -> bool:
+        return True
+
+    async def close(self):
+        pass
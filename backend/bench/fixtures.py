@@ -0,0 +1,96 @@
+import os
+import json
+import random
+import zlib
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+from weaviate.util import generate_uuid5
+
+from app.rag.lexical import tokenize
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROCESSED_DATA_PATH = os.path.join(BASE_DIR, "data", "processed", "documents.jsonl")
+
+# Same dimensionality as text-embedding-3-small
+EMBED_DIM = 1536
+
+
+class LatencyModel:
+    """
+    Log-normal latency distribution given as "median_ms[:sigma]".
+    sigma=0 gives a constant latency; sigma around 0.3-0.6 gives realistic API tails.
+    """
+
+    def __init__(self, median_ms: float, sigma: float = 0.0):
+        self.median_ms = median_ms
+        self.sigma = sigma
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyModel":
+        median, _, sigma = spec.partition(":")
+        return cls(float(median), float(sigma or 0.0))
+
+    def sample(self) -> float:
+        """One latency sample in seconds."""
+        if self.median_ms <= 0:
+            return 0.0
+        if self.sigma <= 0:
+            return self.median_ms / 1000.0
+        return random.lognormvariate(np.log(self.median_ms), self.sigma) / 1000.0
+
+    def __str__(self):
+        return f"{self.median_ms:g}:{self.sigma:g}"
+
+
+def fake_embedding(text: str) -> np.ndarray:
+    """
+    Deterministic stand-in for an embedding model: signed feature hashing of the
+    normalized tokens and their character trigrams, L2-normalized. Texts sharing
+    words get similar vectors, so vector search over fixtures behaves plausibly.
+    """
+    vector = np.zeros(EMBED_DIM, dtype=np.float32)
+    for token in tokenize(text):
+        padded = f"#{token}#"
+        features = [token] + [padded[i:i + 3] for i in range(len(padded) - 2)]
+        for feature in features:
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % EMBED_DIM] += 1.0 if (h >> 16) & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def load_documents(path: str = PROCESSED_DATA_PATH, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    documents = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                documents.append(json.loads(line))
+                if limit and len(documents) >= limit:
+                    break
+    return documents
+
+
+def build_fixtures(documents: List[Dict[str, Any]]):
+    """Vectors, properties and uuids for the fake hybrid backend (documents are embedded by text, as in indexing)."""
+    vectors = np.stack([fake_embedding(doc["text"]) for doc in documents]) if documents else np.zeros((0, EMBED_DIM), dtype=np.float32)
+    properties = [{
+        "text": doc["text"],
+        "question": doc["metadata"]["question"],
+        "section": doc["metadata"]["section"],
+        "source": doc["metadata"]["source"],
+    } for doc in documents]
+    uuids = [str(generate_uuid5(doc["id"])) for doc in documents]
+    return vectors, properties, uuids
+
+
+def sample_questions(documents: List[Dict[str, Any]], n: int, seed: int = 0) -> List[str]:
+    """n questions from the corpus (distinct while the corpus allows, then repeated)."""
+    questions = [doc["metadata"]["question"] for doc in documents]
+    rng = random.Random(seed)
+    out = []
+    while len(out) < n and questions:
+        batch = questions[:]
+        rng.shuffle(batch)
+        out.extend(batch[:n - len(out)])
+    return out
@@ -0,0 +1,243 @@
+"""
+Offline load test for app.main:app.
+
+Runs the real FastAPI app against local stand-ins: a fake OpenAI HTTP server
+(embeddings, rerank and generation) in a separate process, and a fake hybrid
+search backend serving fixtures from data/processed/documents.jsonl. Each stand-in
+has a log-normal latency ("median_ms:sigma"). /chat is driven at increasing
+concurrency and p50/p95/p99, requests/sec and per-stage times are reported.
+
+Usage (from backend/):
+    python -m bench.run_bench --concurrency 1,8,32 --output storage/bench.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+from bench.fixtures import LatencyModel, load_documents, build_fixtures, sample_questions
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _serve_fake_openai(port: int, latency_specs: dict, token_interval_ms: float):
+    import uvicorn
+    from bench.fake_openai import create_app
+    latency = {name: LatencyModel.parse(spec) for name, spec in latency_specs.items()}
+    uvicorn.run(create_app(latency, token_interval_ms), host="127.0.0.1", port=port, log_level="warning")
+
+
+class _TraceCollector(logging.Handler):
+    """Collects the per-request stage breakdown logged by app.rag.metrics."""
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.records = []
+
+    def emit(self, record):
+        message = record.getMessage()
+        if message.startswith("request "):
+            self.records.append(json.loads(message[len("request "):]))
+
+
+def _wait_until_up(url: str, timeout: float = 30.0):
+    import httpx
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"Server at {url} did not start")
+
+
+def _percentiles(values) -> dict:
+    if not values:
+        return {}
+    arr = np.asarray(values)
+    return {
+        "mean": round(float(arr.mean()), 1),
+        "p50": round(float(np.percentile(arr, 50)), 1),
+        "p95": round(float(np.percentile(arr, 95)), 1),
+        "p99": round(float(np.percentile(arr, 99)), 1),
+        "max": round(float(arr.max()), 1),
+    }
+
+
+async def _run_level(base_url: str, endpoint: str, questions: list, concurrency: int) -> dict:
+    import httpx
+    latencies, errors = [], 0
+    pending = iter(questions)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120.0) as client:
+        async def worker():
+            nonlocal errors
+            for question in pending:
+                start = time.perf_counter()
+                try:
+                    response = await client.post(endpoint, json={"message": question})
+                    body = await response.aread()
+                    if response.status_code != 200 or b"event: error" in body:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(questions),
+        "errors": errors,
+        "wall_s": round(wall, 2),
+        "rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "latency_ms": _percentiles(latencies),
+    }
+
+
+def _stage_summary(records: list) -> dict:
+    per_stage = {}
+    for record in records:
+        for stage_name, ms in record.get("stages_ms", {}).items():
+            per_stage.setdefault(stage_name, []).append(ms)
+    return {name: {k: v for k, v in _percentiles(values).items() if k in ("mean", "p95")}
+            for name, values in per_stage.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline /chat load test with fake OpenAI and hybrid backends.")
+    parser.add_argument("--concurrency", default="1,8,32,64", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=0, help="Requests per level (default: max(20, 5 x concurrency))")
+    parser.add_argument("--endpoint", default="/chat", choices=["/chat", "/chat/stream"])
+    parser.add_argument("--backend", default="weaviate", choices=["weaviate", "local"], help="RETRIEVER_BACKEND to exercise")
+    parser.add_argument("--quantization", default="none", choices=["none", "int8", "binary"],
+                        help="LOCAL_QUANTIZATION of the fixture index")
+    parser.add_argument("--embed-latency", default="50:0.3", help="Fake embeddings latency, median_ms:sigma")
+    parser.add_argument("--hybrid-latency", default="15:0.3", help="Fake hybrid query latency, median_ms:sigma")
+    parser.add_argument("--rerank-latency", default="400:0.4", help="Fake rerank completion latency, median_ms:sigma")
+    parser.add_argument("--generate-latency", default="800:0.4", help="Fake generation latency (time to first token), median_ms:sigma")
+    parser.add_argument("--token-interval-ms", type=float, default=0.0, help="Delay between streamed chunks")
+    parser.add_argument("--docs", type=int, default=0, help="Use only the first N documents as fixtures (0 = all)")
+    parser.add_argument("--with-caches", action="store_true", help="Keep the embedding/semantic/rerank caches enabled")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    args = parser.parse_args()
+
+    # Configure the app before importing it (modules read env at import time)
+    openai_port, app_port = _free_port(), _free_port()
+    tmp_dir = tempfile.mkdtemp(prefix="bench-")
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{openai_port}/v1"
+    os.environ["OPENAI_API_KEY"] = "bench"
+    os.environ["RETRIEVER_BACKEND"] = args.backend
+    os.environ["LOCAL_QUANTIZATION"] = args.quantization
+    os.environ["EMBED_CACHE_PATH"] = os.path.join(tmp_dir, "embedding_cache.sqlite3")
+    os.environ["LEXICAL_INDEX_PATH"] = os.path.join(tmp_dir, "lexical_index.npz")
+    os.environ["INDEX_VERSION_PATH"] = os.path.join(tmp_dir, "index_version")
+    if not args.with_caches:
+        for name in ("EMBED_CACHE_ENABLED", "SEMANTIC_CACHE_ENABLED", "RERANK_CACHE_ENABLED"):
+            os.environ[name] = "0"
+
+    import uvicorn
+    from app.rag import clients, local_index
+    from app.rag.index_version import current_version
+    from app.rag.local_index import LocalHybridIndex
+    from bench.fake_weaviate import FakeAsyncWeaviateClient
+    import app.main
+
+    latency_specs = {"embed": args.embed_latency, "rerank": args.rerank_latency, "generate": args.generate_latency}
+    fake_openai = multiprocessing.get_context("spawn").Process(
+        target=_serve_fake_openai, args=(openai_port, latency_specs, args.token_interval_ms), daemon=True,
+    )
+    fake_openai.start()
+
+    documents = load_documents(limit=args.docs or None)
+    start = time.perf_counter()
+    index = LocalHybridIndex(*build_fixtures(documents))
+    print(f"Fixtures: {len(index)} documents in {time.perf_counter() - start:.1f}s")
+
+    # Route the app's hybrid search to the fixtures
+    clients._async_weaviate_client = FakeAsyncWeaviateClient(index, LatencyModel.parse(args.hybrid_latency))
+    if args.backend == "local":
+        local_index._local_index = index
+        local_index._local_index_version = current_version()
+
+    collector = _TraceCollector()
+    metrics_logger = logging.getLogger("app.rag.metrics")
+    metrics_logger.setLevel(logging.INFO)
+    metrics_logger.addHandler(collector)
+    metrics_logger.propagate = False
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    server = uvicorn.Server(uvicorn.Config(app.main.app, host="127.0.0.1", port=app_port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+
+    base_url = f"http://127.0.0.1:{app_port}"
+    report = {
+        "config": {
+            "endpoint": args.endpoint, "backend": args.backend, "documents": len(index),
+            "quantization": args.quantization,
+            "with_caches": args.with_caches, "latency": {**latency_specs, "hybrid": args.hybrid_latency},
+            "token_interval_ms": args.token_interval_ms,
+        },
+        "levels": [],
+    }
+    try:
+        _wait_until_up(f"http://127.0.0.1:{openai_port}/counters")
+        _wait_until_up(f"{base_url}/health")
+
+        levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+        total = sum(args.requests or max(20, 5 * c) for c in levels)
+        questions = sample_questions(documents, total, seed=args.seed)
+
+        print(f"{'conc':>5} {'reqs':>5} {'err':>4} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}  stages (mean ms)")
+        offset = 0
+        for concurrency in levels:
+            n = args.requests or max(20, 5 * concurrency)
+            collector.records.clear()
+            result = asyncio.run(_run_level(base_url, args.endpoint, questions[offset:offset + n], concurrency))
+            offset += n
+            result["stages_ms"] = _stage_summary(collector.records)
+            report["levels"].append(result)
+
+            lat = result["latency_ms"]
+            stages = " ".join(f"{name}={s['mean']:.0f}" for name, s in result["stages_ms"].items())
+            print(f"{concurrency:>5} {n:>5} {result['errors']:>4} {result['rps']:>8.2f} "
+                  f"{lat.get('p50', 0):>8.1f} {lat.get('p95', 0):>8.1f} {lat.get('p99', 0):>8.1f}  {stages}")
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+        fake_openai.terminate()
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Memory footprint vs recall of the quantized local vector index.
+
+Vectors come from the embedding store (filled by scripts/index_weaviate.py); queries
+are a sample of the Saudipedia gold questions, embedded once. For each quantization
+mode and rescore multiplier the vector-only top-k is compared with the exact float32
+top-k (overlap@k) and with the gold document (gold@k). Memory is reported for the
+current corpus and projected to larger ones.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import itertools
+
+import numpy as np
+
+# Paths
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROCESSED_DATA_PATH = os.path.join(BASE_DIR, 'data', 'processed', 'documents.jsonl')
+DEFAULT_REPORT_PATH = os.path.join(BASE_DIR, 'storage', 'quantization_eval.json')
+
+sys.path.append(BASE_DIR)
+from app.rag.retriever import embed_query, EMBEDDING_MODEL
+from app.rag.embedding_store import get_embedding_store
+from app.rag.quantization import QuantizedVectors, l2_normalize
+
+
+def load_documents(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def parse_list(value, cast):
+    return [cast(v) for v in value.split(",") if v.strip()]
+
+
+def exact_top_k(matrix, q, k):
+    scores = matrix @ q
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx])]
+
+
+def mib(nbytes):
+    return round(nbytes / 2**20, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report memory footprint vs recall of the quantized vector index.")
+    parser.add_argument("--sample", type=int, default=200, help="Number of gold questions used as queries")
+    parser.add_argument("--modes", default="int8,binary", help="Quantization modes")
+    parser.add_argument("--rescore", default="1,2,4,8", help="Rescore multipliers (shortlist = k x multiplier)")
+    parser.add_argument("--k", type=int, default=10, help="Hits compared per query")
+    parser.add_argument("--project", default="1000000,10000000", help="Corpus sizes for the memory projection")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=DEFAULT_REPORT_PATH)
+    args = parser.parse_args()
+
+    store = get_embedding_store(EMBEDDING_MODEL)
+    documents = [doc for doc in load_documents(PROCESSED_DATA_PATH) if store.row(doc['text']) is not None]
+    if not documents:
+        print("Error: the embedding store has no vectors for documents.jsonl; run scripts/index_weaviate.py first.")
+        sys.exit(1)
+    rows = np.array([store.row(doc['text']) for doc in documents], dtype=np.int64)
+    k = min(args.k, len(documents))
+
+    picked = random.Random(args.seed).sample(range(len(documents)), min(args.sample, len(documents)))
+    print(f"Embedding {len(picked)} queries against {len(documents)} stored vectors...")
+    queries = [l2_normalize(embed_query(documents[i]['metadata']['question'])) for i in picked]
+
+    exact = l2_normalize(store.matrix()[rows])
+    exact_hits = [exact_top_k(exact, q, k) for q in queries]
+    float_bytes = exact.nbytes
+    dim = exact.shape[1]
+
+    def gold_recall(hits):
+        return round(float(np.mean([gold in h for gold, h in zip(picked, hits)])), 4)
+
+    results = [{
+        "mode": "float32", "rescore": None, "index_mib": mib(float_bytes), "bytes_per_vector": dim * 4,
+        f"overlap@{k}": 1.0, f"gold@{k}": gold_recall(exact_hits),
+    }]
+    for mode in parse_list(args.modes, str):
+        start = time.perf_counter()
+        index = QuantizedVectors(store.matrix(), mode, rows=rows)
+        build_s = time.perf_counter() - start
+        for rescore in parse_list(args.rescore, int):
+            index.rescore = rescore
+            hits, latencies = [], []
+            for q in queries:
+                start = time.perf_counter()
+                hits.append(index.search(q, k)[0])
+                latencies.append((time.perf_counter() - start) * 1000)
+            overlap = np.mean([len(set(h) & set(e)) / k for h, e in zip(hits, exact_hits)])
+            results.append({
+                "mode": mode, "rescore": rescore, "index_mib": mib(index.nbytes),
+                "bytes_per_vector": index.nbytes // len(index), "build_s": round(build_s, 2),
+                f"overlap@{k}": round(float(overlap), 4), f"gold@{k}": gold_recall(hits),
+                "latency_ms": {"mean": round(float(np.mean(latencies)), 2),
+                               "p95": round(float(np.percentile(latencies, 95)), 2)},
+            })
+
+    print(f"{'mode':<8} {'rescore':>7} {'MiB':>8} {'B/vec':>6} {f'overlap@{k}':>11} {f'gold@{k}':>8} {'mean ms':>8}")
+    for r in results:
+        print(f"{r['mode']:<8} {r['rescore'] or '-':>7} {r['index_mib']:>8} {r['bytes_per_vector']:>6} "
+              f"{r[f'overlap@{k}']:>11} {r[f'gold@{k}']:>8} {r.get('latency_ms', {}).get('mean', '-'):>8}")
+
+    # Resident memory per corpus size; rescoring reads float32 rows from disk on demand
+    projection = {}
+    for n, mode in itertools.product(parse_list(args.project, int), ["float32"] + parse_list(args.modes, str)):
+        per_vector = next(r["bytes_per_vector"] for r in results if r["mode"] == mode)
+        projection.setdefault(str(n), {})[mode] = f"{per_vector * n / 2**30:.2f} GiB"
+    print("\nProjected resident index size:")
+    for n, sizes in projection.items():
+        print(f"  {int(n):>12,} vectors: " + ", ".join(f"{mode}={size}" for mode, size in sizes.items()))
+
+    report = {"documents": len(documents), "queries": len(queries), "k": k, "dim": dim,
+              "results": results, "projection": projection}
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
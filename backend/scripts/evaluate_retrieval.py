@@ -0,0 +1,214 @@
+"""
+Retrieval quality/latency evaluation.
+
+Every Saudipedia Q/A pair is a gold label: asking the document's question should
+retrieve that document. A sample of questions (plus paraphrased variants) is run
+through retrieve() for a grid of settings (hybrid alpha, TOP_K_CANDIDATES, reranker
+on/off, RERANK_THRESHOLD). recall@k, MRR and per-stage latency are reported for
+each setting and written to a JSON report.
+
+Each reranked setting costs one reranker call per query:
+    queries x len(alpha) x len(candidates)
+Thresholds are applied to the same reranked list, so they add no calls.
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import itertools
+
+import numpy as np
+
+# Score every setting with fresh reranker calls (cached scores would hide latency)
+os.environ.setdefault("RERANK_CACHE_ENABLED", "0")
+
+# Paths
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROCESSED_DATA_PATH = os.path.join(BASE_DIR, 'data', 'processed', 'documents.jsonl')
+DEFAULT_REPORT_PATH = os.path.join(BASE_DIR, 'storage', 'retrieval_eval.json')
+
+sys.path.append(BASE_DIR)
+from app.rag.retriever import retrieve, embed_query
+from app.rag.lexical import normalize_question
+from app.rag.metrics import request_trace
+
+# Dialectal swaps for the leading interrogative (MSA -> Gulf/Najdi)
+INTERROGATIVE_SWAPS = [
+    ("ما هي ", "وش هي "), ("ما هو ", "وش هو "), ("من هو ", "مين "),
+    ("كيف ", "شلون "), ("أين ", "وين "), ("متى ", "في أي سنة "), ("ما ", "وش "),
+]
+REQUEST_PREFIXES = ["أريد أن أعرف ", "ممكن توضح لي ", "عندي سؤال: "]
+STOPWORDS = {"ما", "هي", "هو", "من", "في", "على", "عن", "إلى", "الى", "هل", "كيف", "متى", "أين", "ماذا", "لماذا", "كم"}
+
+
+def load_documents(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def paraphrases(question, rng):
+    """Rule-based perturbations of a question: dialect, wrapped request, orthography, keywords."""
+    variants = {}
+    for msa, dialect in INTERROGATIVE_SWAPS:
+        if question.startswith(msa):
+            variants["dialect"] = dialect + question[len(msa):]
+            break
+    bare = question.rstrip("؟? ")
+    variants["prefix"] = rng.choice(REQUEST_PREFIXES) + bare
+    variants["orthographic"] = bare.replace("أ", "ا").replace("إ", "ا").replace("ة", "ه")
+    keywords = [w for w in bare.split() if w not in STOPWORDS]
+    if keywords:
+        variants["keywords"] = " ".join(keywords)
+    return {kind: text for kind, text in variants.items() if text != question}
+
+
+def build_queries(documents, sample, with_paraphrases, seed):
+    rng = random.Random(seed)
+    picked = rng.sample(documents, min(sample, len(documents)))
+    queries = []
+    for doc in picked:
+        gold = normalize_question(doc['metadata']['question'])
+        queries.append({"text": doc['metadata']['question'], "gold": gold, "kind": "original"})
+        if with_paraphrases:
+            for kind, text in paraphrases(doc['metadata']['question'], rng).items():
+                queries.append({"text": text, "gold": gold, "kind": kind})
+    return queries
+
+
+def gold_rank(results, gold):
+    """1-based rank of the gold document in the results, or None."""
+    for rank, res in enumerate(results, 1):
+        if normalize_question(res.get('question', '')) == gold:
+            return rank
+    return None
+
+
+def apply_threshold(reranked, threshold, top_k):
+    """Same selection as retrieve(): trusted/fallback candidates bypass the threshold."""
+    kept = [c for c in reranked
+            if c.get('rerank_fallback') or c.get('rerank_trusted') or c.get('rerank_score', 0.0) >= threshold]
+    return kept[:top_k]
+
+
+def summarize(ranks, kinds, ks, latencies, stage_times):
+    ranks = np.array([r or 0 for r in ranks])
+    found = ranks > 0
+    summary = {f"recall@{k}": round(float(np.mean(found & (ranks <= k))), 4) for k in ks}
+    summary["mrr"] = round(float(np.mean(np.where(found, 1.0 / np.maximum(ranks, 1), 0.0))), 4)
+    max_k = max(ks)
+    summary[f"recall@{max_k}_by_kind"] = {
+        kind: round(float(np.mean([f and r <= max_k for f, r, q in zip(found, ranks, kinds) if q == kind])), 4)
+        for kind in sorted(set(kinds))
+    }
+    lat = np.array(latencies)
+    summary["latency_ms"] = {
+        "mean": round(float(lat.mean()), 1),
+        "p50": round(float(np.percentile(lat, 50)), 1),
+        "p95": round(float(np.percentile(lat, 95)), 1),
+    }
+    summary["stages_ms"] = {name: round(float(np.mean(times)), 1) for name, times in stage_times.items()}
+    return summary
+
+
+def parse_list(value, cast):
+    return [cast(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate retrieval quality and latency over a settings grid.")
+    parser.add_argument("--sample", type=int, default=100, help="Number of gold questions to sample")
+    parser.add_argument("--no-paraphrases", action="store_true", help="Only use the original questions")
+    parser.add_argument("--alpha", default="0.4,0.6,0.8", help="Hybrid alpha values")
+    parser.add_argument("--candidates", default="10,20", help="TOP_K_CANDIDATES values")
+    parser.add_argument("--rerank", default="on,off", help="Reranker on and/or off")
+    parser.add_argument("--threshold", default="0.3,0.5,0.7", help="RERANK_THRESHOLD values (reranker on only)")
+    parser.add_argument("--k", default="1,3,5", help="Cutoffs for recall@k")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="Max recall drop accepted for a cheaper setting")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=DEFAULT_REPORT_PATH)
+    args = parser.parse_args()
+
+    logging.getLogger("app.rag.metrics").setLevel(logging.WARNING)
+
+    ks = parse_list(args.k, int)
+    max_k = max(ks)
+    alphas = parse_list(args.alpha, float)
+    candidate_counts = parse_list(args.candidates, int)
+    rerank_modes = [m == "on" for m in parse_list(args.rerank, str)]
+    thresholds = parse_list(args.threshold, float)
+
+    documents = load_documents(PROCESSED_DATA_PATH)
+    queries = build_queries(documents, args.sample, not args.no_paraphrases, args.seed)
+    kinds = [q["kind"] for q in queries]
+    print(f"Evaluating {len(queries)} queries ({args.sample} gold questions) over "
+          f"{len(alphas) * len(candidate_counts) * len(rerank_modes)} retrieval settings")
+
+    # Embed once; every setting reuses the same query vectors
+    embed_ms = []
+    vectors = []
+    for q in queries:
+        start = time.perf_counter()
+        vectors.append(embed_query(q["text"]))
+        embed_ms.append((time.perf_counter() - start) * 1000)
+
+    settings = []
+    for alpha, num_candidates, rerank_enabled in itertools.product(alphas, candidate_counts, rerank_modes):
+        ranked_lists, latencies, stage_times = [], [], {"embed": embed_ms}
+        for q, vector in zip(queries, vectors):
+            start = time.perf_counter()
+            with request_trace("evaluate") as trace:
+                # Threshold 0 keeps the whole reranked list; thresholds are applied below
+                results = retrieve(
+                    q["text"], top_k=num_candidates if rerank_enabled else max_k, query_vector=vector,
+                    alpha=alpha, num_candidates=num_candidates, rerank_enabled=rerank_enabled, threshold=0.0,
+                )
+            latencies.append((time.perf_counter() - start) * 1000)
+            for name, seconds in trace.stages.items():
+                stage_times.setdefault(name, []).append(seconds * 1000)
+            ranked_lists.append(results)
+
+        for threshold in (thresholds if rerank_enabled else [None]):
+            if threshold is None:
+                selected = [r[:max_k] for r in ranked_lists]
+            else:
+                selected = [apply_threshold(r, threshold, max_k) for r in ranked_lists]
+            ranks = [gold_rank(r, q["gold"]) for r, q in zip(selected, queries)]
+            setting = {"alpha": alpha, "top_k_candidates": num_candidates,
+                       "rerank": rerank_enabled, "rerank_threshold": threshold}
+            setting.update(summarize(ranks, kinds, ks, latencies, stage_times))
+            settings.append(setting)
+            print(f"alpha={alpha:<4} cand={num_candidates:<3} rerank={'on ' if rerank_enabled else 'off'} "
+                  f"thr={'-' if threshold is None else threshold:<4} "
+                  f"R@1={setting['recall@1'] if 'recall@1' in setting else '-'} "
+                  f"R@{max_k}={setting[f'recall@{max_k}']} MRR={setting['mrr']} "
+                  f"mean={setting['latency_ms']['mean']}ms p95={setting['latency_ms']['p95']}ms")
+
+    # Cheapest setting whose recall@max_k is within tolerance of the best
+    best_recall = max(s[f"recall@{max_k}"] for s in settings)
+    eligible = [s for s in settings if s[f"recall@{max_k}"] >= best_recall - args.tolerance]
+    recommended = min(eligible, key=lambda s: s["latency_ms"]["mean"])
+
+    report = {
+        "queries": len(queries),
+        "gold_questions": args.sample,
+        "paraphrases": not args.no_paraphrases,
+        "seed": args.seed,
+        "k": ks,
+        "settings": settings,
+        "recommended": recommended,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"\nRecommended: alpha={recommended['alpha']} top_k_candidates={recommended['top_k_candidates']} "
+          f"rerank={recommended['rerank']} threshold={recommended['rerank_threshold']} "
+          f"(recall@{max_k}={recommended[f'recall@{max_k}']}, mean {recommended['latency_ms']['mean']}ms)")
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,112 @@
 import json
+import hashlib
 import os
 import sys
+import time
+import queue
+import random
+import argparse
+import threading
 import weaviate
 import numpy as np
 from weaviate.util import generate_uuid5
 from weaviate.classes.data import DataObject
+from weaviate.classes.query import Filter
 from dotenv import load_dotenv
 
 # Paths
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 PROCESSED_DATA_PATH = os.path.join(BASE_DIR, 'data', 'processed', 'documents.jsonl')
-CHECKPOINT_PATH = os.path.join(BASE_DIR, 'storage', 'weaviate_indexed_ids.txt')
+# Manifest of what is in Weaviate: one "doc_id<TAB>content_hash" line per write,
+# "doc_id<TAB>-" for a deletion; the last line for an id wins. Compacted after each run.
+MANIFEST_PATH = os.path.join(BASE_DIR, 'storage', 'weaviate_manifest.tsv')
+TOMBSTONE = "-"
+DELETE_BATCH_SIZE = 500
+
+sys.path.append(BASE_DIR)
+from app.rag.index_version import bump_version
+from app.rag.embedding_store import get_embedding_store
 
 # Configuration
 BATCH_SIZE = 64
 COLLECTION_NAME = "KnowledgeDocument"
 ST_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+OPENAI_MODEL_NAME = "text-embedding-3-small"
+
+# Pipelined mode: embedding threads, queue of embedded batches waiting for the writer,
+# docs written per checkpointed flush, and retry policy for rate limits/transient errors
+EMBED_WORKERS = 4
+QUEUE_SIZE = 8
+CHECKPOINT_EVERY = 512
+EMBED_MAX_RETRIES = 6
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+RETRYABLE_ERRORS = {"RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError"}
 
 # Global provider tracker
 EMBEDDING_PROVIDER = None # "ST" or "OPENAI"
 
-def load_checkpoint():
-    if not os.path.exists(CHECKPOINT_PATH):
-        return set()
-    with open(CHECKPOINT_PATH, 'r', encoding='utf-8') as f:
-        return set(line.strip() for line in f)
+def content_hash(doc):
+    """Hash of everything stored for a document; a change means re-embed and upsert."""
+    payload = json.dumps([doc['text'], doc['metadata']['question'], doc['metadata']['section'],
+                          doc['metadata']['source']], ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+def load_manifest():
+    manifest = {}
+    if not os.path.exists(MANIFEST_PATH):
+        return manifest
+    with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+        for line in f:
+            doc_id, sep, digest = line.rstrip('\n').rpartition('\t')
+            if not sep or not digest:
+                continue  # torn last line after a crash
+            if digest == TOMBSTONE:
+                manifest.pop(doc_id, None)
+            else:
+                manifest[doc_id] = digest
+    return manifest
+
+def update_checkpoint(entries):
+    """Append (doc_id, hash) entries to the manifest."""
+    os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+    with open(MANIFEST_PATH, 'a', encoding='utf-8') as f:
+        for doc_id, digest in entries:
+            f.write(f"{doc_id}\t{digest}\n")
+        # Durable before we move on, so a crash never skips unwritten docs
+        f.flush()
+        os.fsync(f.fileno())
 
-def update_checkpoint(ids):
-    os.makedirs(os.path.dirname(CHECKPOINT_PATH), exist_ok=True)
-    with open(CHECKPOINT_PATH, 'a', encoding='utf-8') as f:
-        for doc_id in ids:
-            f.write(f"{doc_id}\n")
+def compact_manifest():
+    manifest = load_manifest()
+    tmp_path = MANIFEST_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for doc_id, digest in manifest.items():
+            f.write(f"{doc_id}\t{digest}\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, MANIFEST_PATH)
+
+def delete_documents(collection, doc_ids):
+    """Delete documents (by their uuid5) from Weaviate and tombstone them in the manifest."""
+    deleted = 0
+    for i in range(0, len(doc_ids), DELETE_BATCH_SIZE):
+        chunk = doc_ids[i:i + DELETE_BATCH_SIZE]
+        result = collection.data.delete_many(
+            where=Filter.by_id().contains_any([generate_uuid5(doc_id) for doc_id in chunk])
+        )
+        deleted += result.successful
+        update_checkpoint([(doc_id, TOMBSTONE) for doc_id in chunk])
+    return deleted
+
+def prune_unknown_objects(collection, doc_ids):
+    """Delete objects whose uuid is not the uuid5 of one of doc_ids (e.g. random uuids from older runs)."""
+    expected = {str(generate_uuid5(doc_id)) for doc_id in doc_ids}
+    unknown = [obj.uuid for obj in collection.iterator(return_properties=["section"])
+               if str(obj.uuid) not in expected]
+    for i in range(0, len(unknown), DELETE_BATCH_SIZE):
+        collection.data.delete_many(where=Filter.by_id().contains_any(unknown[i:i + DELETE_BATCH_SIZE]))
+    return len(unknown)
 
 def get_embedding_model():
     global EMBEDDING_PROVIDER
@@ -75,7 +151,7 @@ def encode_text(model, texts):
         try:
             # Replace newlines
             clean_texts = [t.replace("\n", " ") for t in texts]
-            response = model.embeddings.create(input=clean_texts, model="text-embedding-3-small")
+            response = model.embeddings.create(input=clean_texts, model=OPENAI_MODEL_NAME)
             return [data.embedding for data in response.data]
         except Exception as e:
             print(f"OpenAI Embedding Error: {e}")
@@ -83,7 +159,177 @@ def encode_text(model, texts):
     else:
         raise ValueError("Unknown embedding provider")
 
-def main():
+def embedding_store():
+    """On-disk store of the vectors already computed with the current provider's model."""
+    return get_embedding_store(ST_MODEL_NAME if EMBEDDING_PROVIDER == "ST" else OPENAI_MODEL_NAME)
+
+def embed_with_store(model, texts, embed=encode_text):
+    """Vectors for texts, read from the embedding store; only texts it lacks are embedded (and appended)."""
+    store = embedding_store()
+    missing = store.missing(texts)
+    if missing:
+        store.add_many(missing, embed(model, missing))
+    return store.get_many(texts)
+
+def doc_properties(doc):
+    return {
+        "text": doc['text'],
+        "question": doc['metadata']['question'],
+        "section": doc['metadata']['section'],
+        "source": doc['metadata']['source'],
+    }
+
+def _retry_after(e):
+    """Seconds from a Retry-After header on the error's HTTP response, if any."""
+    headers = getattr(getattr(e, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+def embed_with_retry(model, texts):
+    """encode_text with exponential backoff + jitter on rate limits and transient API errors."""
+    delay = RETRY_BASE_DELAY
+    for attempt in range(1, EMBED_MAX_RETRIES + 1):
+        try:
+            return encode_text(model, texts)
+        except Exception as e:
+            if attempt == EMBED_MAX_RETRIES or type(e).__name__ not in RETRYABLE_ERRORS:
+                raise
+            wait = _retry_after(e) or delay * (1 + random.random())
+            delay = min(delay * 2, RETRY_MAX_DELAY)
+            print(f"Embedding retry {attempt}/{EMBED_MAX_RETRIES - 1} in {wait:.1f}s ({type(e).__name__})", flush=True)
+            time.sleep(wait)
+
+def index_sequential(collection, model, docs_to_index):
+    """One batch at a time: embed, upsert (insert_many), checkpoint. Stops at the first failed batch."""
+    indexed = 0
+    total_batches = (len(docs_to_index) + BATCH_SIZE - 1) // BATCH_SIZE
+
+    for i in range(0, len(docs_to_index), BATCH_SIZE):
+        print(f"Starting batch {i}", flush=True)
+        batch_docs = docs_to_index[i:i + BATCH_SIZE]
+        batch_texts = [doc['text'] for doc in batch_docs] 
+        
+        try:
+            # Generate embeddings
+            # print("Encoding...", flush=True)
+            embeddings = embed_with_store(model, batch_texts)
+            
+            # Prepare objects for Weaviate
+            objects_to_insert = []
+            written = []
+            
+            for j, doc in enumerate(batch_docs):
+                vector = embeddings[j]
+                if isinstance(vector, np.ndarray):
+                    vector = vector.tolist()
+
+                objects_to_insert.append(DataObject(
+                    properties=doc_properties(doc),
+                    vector=vector,
+                    uuid=generate_uuid5(doc['id']),
+                ))
+                written.append((doc['id'], content_hash(doc)))
+            
+            # Insert batch
+            # print("Inserting...", flush=True)
+            result = collection.data.insert_many(objects_to_insert)
+            if result.has_errors:
+                 print(f"Errors in batch {i}: {result.errors}", file=sys.stdout, flush=True)
+                 written = [w for j, w in enumerate(written) if j not in result.errors]
+            
+            # Update checkpoint
+            update_checkpoint(written)
+            indexed += len(written)
+            
+            if (i // BATCH_SIZE + 1) % 5 == 0 or (i + BATCH_SIZE >= len(docs_to_index)):
+                 print(f"Indexed batch {i // BATCH_SIZE + 1}/{total_batches} ({len(batch_docs)} docs) - {EMBEDDING_PROVIDER}", flush=True)
+
+        except Exception as e:
+            print(f"BATCH_ERROR: {str(e)[:200]}", file=sys.stdout, flush=True)
+            break
+
+    return indexed
+
+def index_pipelined(collection, model, docs_to_index, workers=EMBED_WORKERS, checkpoint_every=CHECKPOINT_EVERY):
+    """
+    Embedding and insertion overlap: `workers` threads embed batches into a bounded
+    queue while this thread drains it into Weaviate's dynamic (gRPC) batcher.
+    Every `checkpoint_every` docs the batcher is flushed, failed objects are collected
+    and only the docs Weaviate accepted are recorded in the manifest (fsync), so a crash
+    at any point re-indexes at most one unflushed group. Objects get a uuid5 of the doc
+    id, so re-sending a doc overwrites it instead of duplicating it.
+    A batch that still fails after the embedding retries is skipped (and picked up
+    by the next run) instead of aborting the whole index.
+    """
+    if EMBEDDING_PROVIDER == "ST":
+        workers = 1  # a local model is already parallel inside encode()
+
+    work = queue.Queue()
+    for i in range(0, len(docs_to_index), BATCH_SIZE):
+        work.put(docs_to_index[i:i + BATCH_SIZE])
+    embedded = queue.Queue(maxsize=QUEUE_SIZE)
+
+    def embed_worker():
+        while True:
+            try:
+                batch_docs = work.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                embedded.put((batch_docs, embed_with_store(model, [doc['text'] for doc in batch_docs], embed_with_retry)))
+            except Exception as e:
+                embedded.put((batch_docs, e))
+        embedded.put(None)
+
+    threads = [threading.Thread(target=embed_worker, daemon=True) for _ in range(workers)]
+    for t in threads:
+        t.start()
+
+    start = time.perf_counter()
+    indexed = failed = 0
+    finished_workers = 0
+    while finished_workers < workers:
+        group = {}  # uuid -> doc
+        with collection.batch.dynamic() as batch:
+            while len(group) < checkpoint_every and finished_workers < workers:
+                item = embedded.get()
+                if item is None:
+                    finished_workers += 1
+                    continue
+                batch_docs, embeddings = item
+                if isinstance(embeddings, Exception):
+                    failed += len(batch_docs)
+                    print(f"BATCH_ERROR (skipped {len(batch_docs)} docs): {str(embeddings)[:200]}", flush=True)
+                    continue
+                for doc, vector in zip(batch_docs, embeddings):
+                    if isinstance(vector, np.ndarray):
+                        vector = vector.tolist()
+                    uuid = generate_uuid5(doc['id'])
+                    batch.add_object(properties=doc_properties(doc), vector=vector, uuid=uuid)
+                    group[str(uuid)] = doc
+
+        rejected = {str(obj.object_.uuid) for obj in collection.batch.failed_objects}
+        if rejected:
+            failed += len(rejected)
+            print(f"Weaviate rejected {len(rejected)} objects (left for the next run): "
+                  f"{collection.batch.failed_objects[0].message[:200]}", flush=True)
+        written = [(doc['id'], content_hash(doc)) for uuid, doc in group.items() if uuid not in rejected]
+        update_checkpoint(written)
+        indexed += len(written)
+
+        elapsed = time.perf_counter() - start
+        if group:
+            print(f"Indexed {indexed}/{len(docs_to_index)} docs ({indexed / elapsed:.1f} docs/sec) - {EMBEDDING_PROVIDER}", flush=True)
+
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    print(f"Pipelined indexing: {indexed} docs in {elapsed:.1f}s ({indexed / max(elapsed, 1e-9):.1f} docs/sec), {failed} failed")
+    return indexed
+
+def main(pipelined=False, workers=EMBED_WORKERS):
     print(f"Connecting to Weaviate at http://localhost:8080...")
     client = weaviate.connect_to_local(port=8080)
     
@@ -104,67 +350,55 @@ def main():
 
     print(f"Total documents: {len(documents)}")
 
-    indexed_ids = load_checkpoint()
-    print(f"Already indexed: {len(indexed_ids)}")
+    collection = client.collections.get(COLLECTION_NAME)
+    object_count = collection.aggregate.over_all(total_count=True).total_count
+    manifest = load_manifest()
+    if manifest and not object_count:
+        print("Collection is empty; ignoring the manifest and indexing everything.")
+        os.remove(MANIFEST_PATH)
+        manifest = {}
+    elif not manifest and object_count:
+        # Objects from before the manifest have random uuids and can't be matched to docs;
+        # they keep serving until every doc has been written under its uuid5 (pruned below)
+        print(f"No manifest for {object_count} existing objects; re-indexing everything before pruning them.")
 
-    docs_to_index = [doc for doc in documents if doc['id'] not in indexed_ids]
-    print(f"Documents to index: {len(docs_to_index)}")
+    hashes = {doc['id']: content_hash(doc) for doc in documents}
+    docs_to_index = [doc for doc in documents if manifest.get(doc['id']) != hashes[doc['id']]]
+    removed_ids = [doc_id for doc_id in manifest if doc_id not in hashes]
+    new_count = sum(1 for doc in docs_to_index if doc['id'] not in manifest)
+    print(f"Unchanged: {len(documents) - len(docs_to_index)}, new: {new_count}, "
+          f"changed: {len(docs_to_index) - new_count}, removed: {len(removed_ids)}")
+    store = embedding_store()
+    to_embed = len(store.missing([doc['text'] for doc in docs_to_index]))
+    print(f"Embedding store: {len(store)} vectors, {to_embed} texts to embed")
 
+    indexed = deleted = pruned = 0
     if not docs_to_index:
         print("All documents already indexed.")
+    elif pipelined:
+        indexed = index_pipelined(collection, model, docs_to_index, workers=workers)
     else:
-        collection = client.collections.get(COLLECTION_NAME)
-        
-        # Batch processing
-        total_batches = (len(docs_to_index) + BATCH_SIZE - 1) // BATCH_SIZE
-        
-        for i in range(0, len(docs_to_index), BATCH_SIZE):
-            print(f"Starting batch {i}", flush=True)
-            batch_docs = docs_to_index[i:i + BATCH_SIZE]
-            batch_texts = [doc['text'] for doc in batch_docs] 
-            
-            try:
-                # Generate embeddings
-                # print("Encoding...", flush=True)
-                embeddings = encode_text(model, batch_texts)
-                
-                # Prepare objects for Weaviate
-                objects_to_insert = []
-                current_ids = []
-                
-                for j, doc in enumerate(batch_docs):
-                    properties = {
-                        "text": doc['text'],
-                        "question": doc['metadata']['question'],
-                        "section": doc['metadata']['section'],
-                        "source": doc['metadata']['source'],
-                    }
-                    
-                    vector = embeddings[j]
-                    if isinstance(vector, np.ndarray):
-                        vector = vector.tolist()
+        indexed = index_sequential(collection, model, docs_to_index)
 
-                    objects_to_insert.append(DataObject(
-                        properties=properties,
-                        vector=vector,
-                    ))
-                    current_ids.append(doc['id'])
-                
-                # Insert batch
-                # print("Inserting...", flush=True)
-                result = collection.data.insert_many(objects_to_insert)
-                if result.has_errors:
-                     print(f"Errors in batch {i}: {result.errors}", file=sys.stdout, flush=True)
-                
-                # Update checkpoint
-                update_checkpoint(current_ids)
-                
-                if (i // BATCH_SIZE + 1) % 5 == 0 or (i + BATCH_SIZE >= len(docs_to_index)):
-                     print(f"Indexed batch {i // BATCH_SIZE + 1}/{total_batches} ({len(batch_docs)} docs) - {EMBEDDING_PROVIDER}", flush=True)
+    if removed_ids:
+        deleted = delete_documents(collection, removed_ids)
+        print(f"Deleted {deleted} removed documents.")
+    compact_manifest()
 
-            except Exception as e:
-                print(f"BATCH_ERROR: {str(e)[:200]}", file=sys.stdout, flush=True)
-                break
+    # More objects than manifest entries: leftovers with random uuids (from before the manifest).
+    # Pruned only after a run that wrote every doc, so the live collection is never left partial.
+    manifest = load_manifest()
+    object_count = collection.aggregate.over_all(total_count=True).total_count
+    if object_count > len(manifest):
+        if indexed < len(docs_to_index):
+            print(f"Indexing had failures; keeping {object_count - len(manifest)} unknown objects until a complete run.")
+        else:
+            pruned = prune_unknown_objects(collection, set(manifest) | set(hashes))
+            print(f"Pruned {pruned} objects without a deterministic uuid.")
+
+    # Invalidate API-side caches keyed on indexed content
+    if indexed or deleted or pruned:
+        print(f"Index version: {bump_version()}")
 
     # Final Verification COUNT
     agg = client.collections.get(COLLECTION_NAME).aggregate.over_all(total_count=True)
@@ -172,4 +406,9 @@ def main():
     client.close()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Embed documents.jsonl and index it into Weaviate.")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="Overlap embedding (worker threads) with Weaviate dynamic batch inserts")
+    parser.add_argument("--workers", type=int, default=EMBED_WORKERS, help="Embedding threads in --pipelined mode")
+    args = parser.parse_args()
+    main(pipelined=args.pipelined, workers=args.workers)
@@ -1,4 +1,6 @@
 import pandas as pd
+import numpy as np
+import argparse
 import json
 import os
 import sys
@@ -8,13 +10,111 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 RAW_DATA_PATH = os.path.join(BASE_DIR, 'data', 'raw', 'saudipedia-arabic-qa.csv')
 PROCESSED_DATA_PATH = os.path.join(BASE_DIR, 'data', 'processed', 'documents.jsonl')
 
+# Streaming mode: rows per CSV chunk and output buffer size
+CHUNK_SIZE = 10000
+WRITE_BUFFER_SIZE = 1 << 20
+REQUIRED_COLUMNS = {'section', 'question', 'answer', 'page_link'}
+
 def normalize_text(text):
     if not isinstance(text, str):
         return ""
     # Strip whitespace and collapse multiple spaces
     return " ".join(text.split())
 
-def main():
+def normalize_series(series):
+    """Vectorized normalize_text: collapse whitespace runs and strip."""
+    return series.str.replace(r"\s+", " ", regex=True).str.strip()
+
+def read_csv_chunks(path, encoding, chunksize):
+    return pd.read_csv(
+        path,
+        encoding=encoding,
+        sep=',',
+        quotechar='"',
+        escapechar='\\',
+        on_bad_lines='warn',
+        dtype=str,
+        keep_default_na=False,
+        chunksize=chunksize
+    )
+
+def iter_documents(chunks, stats):
+    """
+    Yield documents chunk by chunk, with the same cleaning as main():
+    drop empty Q/A, keep the first occurrence of each question, normalize whitespace.
+    Duplicates are tracked with a running set of 64-bit question hashes, so memory
+    stays flat however large the input is. Ids use the row index, as in main().
+    """
+    seen = set()
+    for chunk in chunks:
+        if not REQUIRED_COLUMNS.issubset(chunk.columns):
+            raise ValueError(f"Missing required columns. Found: {chunk.columns.tolist()}, Expected: {REQUIRED_COLUMNS}")
+        stats['rows'] += len(chunk)
+
+        chunk = chunk[(chunk['question'].str.strip() != '') & (chunk['answer'].str.strip() != '')]
+        stats['non_empty'] += len(chunk)
+
+        hashes = pd.util.hash_pandas_object(chunk['question'], index=False).to_numpy()
+        keep = np.fromiter((h not in seen and not seen.add(h) for h in hashes.tolist()), dtype=bool, count=len(hashes))
+        chunk = chunk[keep]
+        stats['unique'] += len(chunk)
+
+        questions = normalize_series(chunk['question'])
+        answers = normalize_series(chunk['answer'])
+        for index, section, question, answer, link in zip(
+            chunk.index, chunk['section'], questions, answers, chunk['page_link']
+        ):
+            yield {
+                "id": f"{section}_{index}",
+                "text": answer,
+                "metadata": {
+                    "question": question,
+                    "section": section,
+                    "source": link
+                }
+            }
+
+def write_jsonl_stream(raw_path, output_path, chunksize=CHUNK_SIZE):
+    """Stream the CSV into JSONL through a buffered writer; the output is replaced atomically."""
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = output_path + '.tmp'
+
+    for encoding in ('utf-8', 'utf-8-sig'):
+        stats = {'rows': 0, 'non_empty': 0, 'unique': 0}
+        try:
+            with open(tmp_path, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as f:
+                for doc in iter_documents(read_csv_chunks(raw_path, encoding, chunksize), stats):
+                    f.write(json.dumps(doc, ensure_ascii=False))
+                    f.write('\n')
+            break
+        except UnicodeDecodeError:
+            print(f"{encoding} failed, trying utf-8-sig...")
+    else:
+        raise UnicodeDecodeError("utf-8-sig", b"", 0, 1, "could not decode CSV")
+
+    os.replace(tmp_path, output_path)
+    return stats
+
+def main_stream(output_path, chunksize):
+    print(f"Streaming data from: {RAW_DATA_PATH} (chunks of {chunksize} rows)")
+
+    if not os.path.exists(RAW_DATA_PATH):
+        print(f"Error: File not found at {RAW_DATA_PATH}")
+        sys.exit(1)
+
+    try:
+        stats = write_jsonl_stream(RAW_DATA_PATH, output_path, chunksize)
+    except Exception as e:
+        print(f"Error reading CSV: {e}")
+        sys.exit(1)
+
+    print(f"Rows before cleaning: {stats['rows']}")
+    print(f"Rows after dropping empty Q/A: {stats['non_empty']}")
+    print(f"Rows after deduping questions: {stats['unique']}")
+    print(f"Wrote {stats['unique']} documents to: {output_path}")
+    print("Ingestion complete.")
+
+def main(output_path=PROCESSED_DATA_PATH):
     print(f"Loading data from: {RAW_DATA_PATH}")
     
     if not os.path.exists(RAW_DATA_PATH):
@@ -88,10 +188,10 @@ def main():
         documents.append(doc)
 
     # Write to JSONL
-    print(f"Writing {len(documents)} documents to: {PROCESSED_DATA_PATH}")
-    os.makedirs(os.path.dirname(PROCESSED_DATA_PATH), exist_ok=True)
+    print(f"Writing {len(documents)} documents to: {output_path}")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
     
-    with open(PROCESSED_DATA_PATH, 'w', encoding='utf-8') as f:
+    with open(output_path, 'w', encoding='utf-8') as f:
         for doc in documents:
             json.dump(doc, f, ensure_ascii=False)
             f.write('\n')
@@ -99,4 +199,12 @@ def main():
     print("Ingestion complete.")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Build documents.jsonl from the Saudipedia CSV.")
+    parser.add_argument("--stream", action="store_true", help="Chunked, constant-memory ingestion for large dumps")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE, help="Rows per chunk in --stream mode")
+    parser.add_argument("--output", default=PROCESSED_DATA_PATH)
+    args = parser.parse_args()
+    if args.stream:
+        main_stream(args.output, args.chunksize)
+    else:
+        main(args.output)
@@ -1,5 +1,11 @@
-import weaviate
+import os
 import sys
+import weaviate
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from app.rag.index_version import bump_version
+
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'storage', 'weaviate_manifest.tsv')
 
 def main():
     print("Connecting to Weaviate at http://localhost:8080...")
@@ -11,6 +17,10 @@ def main():
         print(f"Deleting collection '{collection_name}'...")
         client.collections.delete(collection_name)
         print("Collection deleted.")
+        bump_version()
+        # Everything has to be re-indexed now
+        if os.path.exists(MANIFEST_PATH):
+            os.remove(MANIFEST_PATH)
     else:
         print(f"Collection '{collection_name}' does not exist.")
 
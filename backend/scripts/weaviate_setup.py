@@ -1,7 +1,29 @@
+import os
 import weaviate
-from weaviate.classes.config import Property, DataType, Configure
+from weaviate.classes.config import Property, DataType, Configure, Reconfigure
+from dotenv import load_dotenv
 import sys
 
+load_dotenv()
+
+# Vector compression: "none", "pq" (product quantization), "bq" (binary) or "sq" (scalar/int8).
+# BQ/SQ rescore the top WEAVIATE_RESCORE_LIMIT candidates with the uncompressed vectors.
+WEAVIATE_QUANTIZATION = os.getenv("WEAVIATE_QUANTIZATION", "none")
+WEAVIATE_PQ_SEGMENTS = int(os.getenv("WEAVIATE_PQ_SEGMENTS", "0"))  # 0 = Weaviate's default
+WEAVIATE_RESCORE_LIMIT = int(os.getenv("WEAVIATE_RESCORE_LIMIT", "200"))
+
+def quantizer(config):
+    """Quantizer settings for Configure (create) or Reconfigure (update), or None."""
+    if WEAVIATE_QUANTIZATION == "pq":
+        return config.VectorIndex.Quantizer.pq(segments=WEAVIATE_PQ_SEGMENTS or None)
+    if WEAVIATE_QUANTIZATION == "bq":
+        return config.VectorIndex.Quantizer.bq(rescore_limit=WEAVIATE_RESCORE_LIMIT)
+    if WEAVIATE_QUANTIZATION == "sq":
+        return config.VectorIndex.Quantizer.sq(rescore_limit=WEAVIATE_RESCORE_LIMIT)
+    if WEAVIATE_QUANTIZATION != "none":
+        raise ValueError(f"Unknown WEAVIATE_QUANTIZATION: {WEAVIATE_QUANTIZATION}")
+    return None
+
 def main():
     print("Connecting to Weaviate at http://localhost:8080...")
     
@@ -23,6 +45,12 @@ def main():
         
         if client.collections.exists(collection_name):
             print(f"Collection '{collection_name}' already exists.")
+            if quantizer(Reconfigure):
+                # PQ trains on the vectors already in the collection; BQ/SQ can be enabled at any time
+                client.collections.get(collection_name).config.update(
+                    vector_index_config=Reconfigure.VectorIndex.hnsw(quantizer=quantizer(Reconfigure))
+                )
+                print(f"Enabled {WEAVIATE_QUANTIZATION.upper()} compression on '{collection_name}'.")
         else:
             print(f"Creating collection '{collection_name}'...")
             client.collections.create(
@@ -34,6 +62,7 @@ def main():
                     Property(name="source", data_type=DataType.TEXT, skip_vectorization=True),
                 ],
                 # Basic configuration - no specific vectorizer set (will rely on default or none as per docker-compose)
+                vector_index_config=Configure.VectorIndex.hnsw(quantizer=quantizer(Configure)),
             )
             print(f"Collection '{collection_name}' created successfully.")
 